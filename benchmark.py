@@ -0,0 +1,186 @@
+import argparse
+import csv
+import json
+import os
+import sys
+
+from runner import JORS_TABLE, PJS_TOP_TABLE, load_jors_table, run_jobs
+
+MINIMIZE = "min"
+MAXIMIZE = "max"
+
+# Solver: (cost column, time column, direction)
+METRICS = {
+    "cws": ("My Best Sol.", " Time (s)", MINIMIZE),
+    "pjs_top": (" PJS Sol.", "Time (s)", MAXIMIZE),
+    "neh": ("Sol.", "Time (s)", MINIMIZE),
+    "grasp": ("Sol.", "Time (s)", MINIMIZE),
+    "ils": ("Sol.", "Time (s)", MINIMIZE),
+    "tabu": ("Sol.", "Time (s)", MINIMIZE),
+}
+
+NEH_INSTANCES = ["tai044_50_10", "tai084_100_20", "tai109_200_20", "tai117_500_20"]
+
+TSP_JOBS = [
+    {"solver": "grasp", "instance": "berlin52.txt", "params": {"max_iterations": 100, "seed": 0}},
+    {"solver": "ils", "instance": "berlin52.txt", "params": {"max_iterations": 1000, "seed": 0}},
+    {"solver": "tabu", "instance": "berlin52.txt", "params": {"max_iterations": 500, "seed": 0}},
+]
+
+SUITES = ["cws", "pjs_top", "neh", "tsp"]
+
+
+def load_pjs_top_table(path=PJS_TOP_TABLE):
+    with open(path) as table:
+        return {(row["Instance"], float(row["alpha"])): row for row in csv.DictReader(table)}
+
+
+def job_key(job):
+    return job["solver"], job["instance"], json.dumps(job.get("params", {}), sort_keys=True)
+
+
+def instance_file(job):
+    if job["solver"] == "cws":
+        return "data/"+job["instance"]+"_input_nodes.txt"
+    if job["solver"] == "neh":
+        return "pfsp_data/"+job["instance"]+"_inputs.txt"
+    return job["instance"]
+
+
+def suite_jobs(suite, baseline):
+    # Jobs of a suite, each with the reference row it is checked against
+    # (None when there is no reference yet)
+    if suite == "cws":
+        return [({"solver": "cws", "instance": instance, "params": {"vehicle_capacity": float(row["vCap"])}}, row)
+                for instance, row in load_jors_table(JORS_TABLE).items()]
+    if suite == "pjs_top":
+        return [({"solver": "pjs_top", "instance": "data/"+instance+".txt", "params": {"alpha": alpha}}, row)
+                for (instance, alpha), row in load_pjs_top_table().items()]
+    if suite == "neh":
+        jobs = [{"solver": "neh", "instance": instance} for instance in NEH_INSTANCES]
+    elif suite == "tsp":
+        jobs = TSP_JOBS
+    else:
+        raise ValueError(f"Unknown suite: {suite}")
+    # NEH and TSP have no committed table, they are checked against a
+    # previous report when one is given
+    return [(job, baseline.get(job_key(job))) for job in jobs]
+
+
+def load_baseline(path):
+    if path is None:
+        return {}
+    with open(path) as report:
+        results = json.load(report)["results"]
+    cost_time = {}
+    for result in results:
+        if result["cost"] is None:
+            continue
+        cost_column, time_column, _ = METRICS[result["solver"]]
+        cost_time[job_key(result)] = {cost_column: result["cost"], time_column: result["time"]}
+    return cost_time
+
+
+def compare(job, row, reference, cost_tolerance, time_factor, time_slack):
+    cost_column, time_column, direction = METRICS[job["solver"]]
+    if "Error" in row:
+        return {"solver": job["solver"], "instance": job["instance"], "params": job.get("params", {}),
+                "cost": None, "time": None, "reference_cost": None, "reference_time": None,
+                "status": "fail", "failures": ["error"], "error": row["Error"]}
+    cost = float(row[cost_column])
+    time_taken = float(row[time_column])
+    result = {"solver": job["solver"], "instance": job["instance"], "params": job.get("params", {}),
+              "cost": cost, "time": time_taken, "reference_cost": None, "reference_time": None,
+              "status": "new", "failures": []}
+    if reference is None:
+        return result
+
+    reference_cost = float(reference[cost_column])
+    reference_time = float(reference[time_column])
+    result["reference_cost"] = reference_cost
+    result["reference_time"] = reference_time
+    allowed = cost_tolerance * abs(reference_cost) / 100
+    if direction == MINIMIZE and cost > reference_cost + allowed:
+        result["failures"].append("cost")
+    if direction == MAXIMIZE and cost < reference_cost - allowed:
+        result["failures"].append("cost")
+    if time_taken > reference_time * time_factor + time_slack:
+        result["failures"].append("time")
+    result["status"] = "fail" if result["failures"] else "pass"
+    return result
+
+
+def run_benchmark(suites, baseline=None, cost_tolerance=0.0, time_factor=1.5, time_slack=0.05, workers=1):
+    # Runs every job of the suites whose instance file is present and
+    # returns one result per job: cost and time against the reference,
+    # with status pass, fail, new (no reference) or missing (no file)
+    jobs = [job_reference for suite in suites for job_reference in suite_jobs(suite, baseline or {})]
+    present = [os.path.exists(instance_file(job)) for job, _ in jobs]
+    checked = [job for (job, _), exists in zip(jobs, present) if exists]
+    rows = iter(run_jobs(checked, workers) if checked else [])
+
+    results = []
+    for (job, reference), exists in zip(jobs, present):
+        if exists:
+            results.append(compare(job, next(rows), reference, cost_tolerance, time_factor, time_slack))
+        else:
+            results.append({"solver": job["solver"], "instance": job["instance"], "params": job.get("params", {}),
+                            "cost": None, "time": None, "reference_cost": None, "reference_time": None,
+                            "status": "missing", "failures": []})
+    return results
+
+
+def summarize(results):
+    summary = {status: 0 for status in ("pass", "fail", "new", "missing")}
+    for result in results:
+        summary[result["status"]] += 1
+    return summary
+
+
+def passed(summary, allow_missing=False):
+    # Missing instance files fail the check unless allowed, and so does a
+    # run in which nothing was compared against a reference
+    if summary["fail"] or (summary["missing"] and not allow_missing):
+        return False
+    return summary["pass"] > 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check solution quality and runtime against the committed result tables")
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=SUITES, help="Suites to run (default: all)")
+    parser.add_argument("--baseline", default=None, help="Previous report, reference for the suites without a table")
+    parser.add_argument("--report", default="benchmark_report.json", help="Machine-readable JSON report")
+    parser.add_argument("--cost-tolerance", type=float, default=0.0, help="Allowed cost degradation in percent")
+    parser.add_argument("--time-factor", type=float, default=1.5, help="Allowed runtime as a multiple of the reference")
+    parser.add_argument("--time-slack", type=float, default=0.05, help="Seconds allowed on top of the runtime factor")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default 1, keeps timings comparable)")
+    parser.add_argument("--allow-missing", action="store_true", help="Do not fail on jobs whose instance file is missing")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.suite, load_baseline(args.baseline), args.cost_tolerance,
+                            args.time_factor, args.time_slack, args.workers)
+    summary = summarize(results)
+    ok = passed(summary, args.allow_missing)
+    settings = {"suites": args.suite, "baseline": args.baseline, "cost_tolerance": args.cost_tolerance,
+                "time_factor": args.time_factor, "time_slack": args.time_slack, "workers": args.workers,
+                "allow_missing": args.allow_missing}
+    with open(args.report, "w") as report:
+        json.dump({"passed": ok, "summary": summary, "settings": settings, "results": results}, report, indent=1)
+
+    for result in results:
+        if "error" in result:
+            print(f"FAIL {result['solver']} {result['instance']} {json.dumps(result['params'])}: {result['error']}")
+        elif result["status"] == "fail":
+            print(f"FAIL {result['solver']} {result['instance']} {json.dumps(result['params'])}: "
+                  f"cost {result['cost']:.2f} (ref {result['reference_cost']:.2f}), "
+                  f"time {result['time']:.3f}s (ref {result['reference_time']:.3f}s)")
+        elif result["status"] == "missing" and not args.allow_missing:
+            print(f"MISSING {result['solver']} {instance_file(result)}")
+    print(", ".join(f"{count} {status}" for status, count in summary.items()) + f" -> {args.report}")
+    if not summary["pass"] and not summary["fail"]:
+        print("No job was compared against a reference")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
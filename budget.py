@@ -0,0 +1,98 @@
+import time
+
+TIME_LIMIT = "time limit"
+MAX_EVALUATIONS = "max evaluations"
+STAGNATION = "stagnation"
+MAX_ITERATIONS = "max iterations"
+STOPPED = "caller"
+
+
+def improves(cost, best_cost):
+    # Cost ties up to rounding do not count as progress, tour costs are
+    # tracked from move deltas and drift by about 1e-12 per round trip
+    return cost < best_cost - 1e-9
+
+
+class Budget:
+    # Limits a search run may use, None meaning no limit: wall time in
+    # seconds from start(), objective evaluations (tour costs and move
+    # deltas, or samples for random search) and iterations in a row without
+    # a new best. The solvers take budget=None and then only stop at their
+    # max_iterations, max_iterations=None leaving only the budget. After a
+    # run stop_reason tells which limit stopped it:
+    # one of the constants above, STOPPED when the caller closed the stream.
+    def __init__(self, time_limit=None, max_evaluations=None, max_stagnation=None):
+        self.time_limit = time_limit
+        self.max_evaluations = max_evaluations
+        self.max_stagnation = max_stagnation
+        self.start()
+
+    def start(self):
+        # Solvers call this when the run starts, so a budget can be reused
+        self.start_time = time.perf_counter()
+        self.elapsed = 0.0
+        self.evaluations = 0
+        self.iteration_count = 0
+        self.stagnation = 0
+        self.stop_reason = None
+        return self
+
+    def add_evaluations(self, count=1):
+        self.evaluations += count
+
+    def end_iteration(self, improved):
+        self.end_iterations(1, 0 if improved else None)
+
+    def end_iterations(self, count, improved_at=None):
+        # count iterations done, improved_at being the index among them of
+        # the last one that found a new best, if any
+        self.iteration_count += count
+        if improved_at is None:
+            self.stagnation += count
+        else:
+            self.stagnation = count - 1 - improved_at
+
+    def exhausted(self):
+        # Limits are checked between iterations, so the last iteration may
+        # go past max_evaluations by its own evaluations
+        if self.time_limit is not None and time.perf_counter() - self.start_time >= self.time_limit:
+            self.finish(TIME_LIMIT)
+        elif self.max_evaluations is not None and self.evaluations >= self.max_evaluations:
+            self.finish(MAX_EVALUATIONS)
+        elif self.max_stagnation is not None and self.stagnation >= self.max_stagnation:
+            self.finish(STAGNATION)
+        return self.stop_reason is not None
+
+    def allowed(self, count):
+        # How many of count further evaluations, each its own iteration,
+        # fit in the evaluation and stagnation limits
+        if self.max_evaluations is not None:
+            count = min(count, self.max_evaluations - self.evaluations)
+        if self.max_stagnation is not None:
+            count = min(count, self.max_stagnation - self.stagnation)
+        return max(count, 0)
+
+    def iterations(self, max_iterations=None):
+        # Loop indices until max_iterations (None: no limit) or until the
+        # budget is exhausted
+        i = 0
+        while max_iterations is None or i < max_iterations:
+            if self.exhausted():
+                return
+            yield i
+            i += 1
+        self.finish(MAX_ITERATIONS)
+
+    def finish(self, reason):
+        # The first reason given is kept
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            self.elapsed = time.perf_counter() - self.start_time
+
+    def as_dict(self):
+        return {"stop_reason": self.stop_reason, "elapsed": self.elapsed, "evaluations": self.evaluations,
+                "iterations": self.iteration_count}
+
+    def __str__(self) -> str:
+        return (f"Stopped by {self.stop_reason} after {self.elapsed:.3f} s, "
+                f"{self.iteration_count} iterations, {self.evaluations} evaluations")
@@ -1,5 +1,14 @@
 import math
+import random
 import time
+import numpy as np
+from distance import node_coords, nearest_points, CoordinateDistances
+from loader import load_instance, load_dist_matrix, CVRP
+from instrumentation import laps, counted
+from parallel import split_work, map_workers, best_result
+
+SAVINGS_DTYPE = np.dtype([('i', np.int32), ('j', np.int32), ('saving', np.float64)])
+
 
 class Node:
     def __init__(self, id, x, y, demand):
@@ -29,59 +38,95 @@ class Route:
         return str(self.edges)
 
 
-def dist(node_1: Node, node_2: Node):
-    return math.sqrt((node_1.x - node_2.x)**2 + (node_1.y - node_2.y)**2)
+def compute_savings_list(nodes, depot, dist_matrix):
+    # Savings of every customer pair i < j, sorted by decreasing saving
+    # (ties keep the (i, j) order)
+    num_nodes = len(nodes)
+    savings = np.empty((num_nodes-1)*(num_nodes-2)//2, dtype=SAVINGS_DTYPE)
+    depot_row = np.asarray(dist_matrix.row(depot.id), dtype=np.float64)
+    offset = 0
+    for i in range(1, num_nodes-1):
+        j = np.arange(i+1, num_nodes)
+        block = savings[offset:offset+len(j)]
+        block['i'] = i
+        block['j'] = j
+        block['saving'] = depot_row[i] + depot_row[j] - dist_matrix.row(i)[i+1:]
+        offset += len(j)
+    order = np.argsort(-savings['saving'], kind='stable')
+    return savings[order]
+
+
+def compute_granular_savings_list(nodes, depot, dist_matrix, num_neighbors):
+    # Savings only for pairs where one customer is among the num_neighbors
+    # closest customers of the other, sorted like compute_savings_list
+    num_nodes = len(nodes)
+    customers = np.arange(1, num_nodes)
+    neighbors = nearest_points(node_coords(nodes[1:]), num_neighbors) + 1
+    pair_i = np.repeat(customers, neighbors.shape[1])
+    pair_j = neighbors.ravel().astype(np.int64)
+    keys = np.unique(np.minimum(pair_i, pair_j) * num_nodes + np.maximum(pair_i, pair_j))
+    pair_i, pair_j = np.divmod(keys, num_nodes)
+
+    savings = np.empty(len(keys), dtype=SAVINGS_DTYPE)
+    savings['i'] = pair_i
+    savings['j'] = pair_j
+    depot_ids = np.full(len(keys), depot.id)
+    savings['saving'] = dist_matrix[depot_ids, pair_i] + dist_matrix[depot_ids, pair_j] - dist_matrix[pair_i, pair_j]
+    order = np.argsort(-savings['saving'], kind='stable')
+    return savings[order]
+
 
+def iter_savings(savings, chunk_size=65536):
+    for start in range(0, len(savings), chunk_size):
+        block = savings[start:start+chunk_size]
+        yield from zip(block['i'].tolist(), block['j'].tolist())
 
-def compute_savings(node_i:Node, node_j:Node, depot:Node, dist_matrix):
-    return dist_matrix[depot.id][node_i.id] + dist_matrix[depot.id][node_j.id] - dist_matrix[node_i.id][node_j.id]
+
+def iter_biased_savings(savings, beta, rng):
+    # Biased-randomized order: each step takes the k-th best remaining
+    # saving with k ~ Geometric(beta). k is small on average, so only a
+    # short buffer at the head of the sorted array is ever materialized.
+    pairs = iter_savings(savings)
+    buffer = []
+    remaining = len(savings)
+    log_base = math.log(1 - beta)
+    while remaining > 0:
+        k = int(math.log(1 - rng.random()) / log_base) % remaining
+        while len(buffer) <= k:
+            buffer.append(next(pairs))
+        yield buffer.pop(k)
+        remaining -= 1
 
 
 def compute_route_cost(route:Route, dist_matrix):
     cost = 0
     for nodes in route.edges:
-        cost += dist_matrix[nodes[0].id][nodes[1].id]
+        cost += dist_matrix[nodes[0].id, nodes[1].id]
     return cost
 
 
-def cws_algorithm(instance_name, vehicle_capacity, print_sols=False):
-    start = time.time()
-    filename = 'data/'+instance_name+'_input_nodes.txt'
-
-    # Load file
-    with open(filename) as instance:
-        i = 0
-        nodes = []
-        for line in instance:
-            data = [float(x) for x in line.split()]
-            node = Node(i, data[0], data[1], data[2])
-            nodes.append(node)
-            i += 1
-
-    num_nodes = len(nodes)
+def cvrp_file_name(instance_name):
+    return 'data/'+instance_name+'_input_nodes.txt'
 
-    # Compute Distance Matrix
-    dist_matrix = [[0]*len(nodes) for _ in range(len(nodes))]
-    for i, node_1 in enumerate(nodes):
-        for j, node_2 in enumerate(nodes):
-            if i<j:
-                dist_matrix[i][j] = dist(node_1, node_2)
-                dist_matrix[j][i] = dist_matrix[i][j]
 
-    depot = nodes[0]
+def load_cvrp_instance(instance_name):
+    arrays = load_instance(cvrp_file_name(instance_name), CVRP)
+    return [Node(i, x, y, demand) for i, ((x, y), demand) in enumerate(zip(arrays["coords"].tolist(), arrays["demands"].tolist()))]
 
-    # Compute Savings List
-    savings = []
-    for node_i in nodes[1:-1]:
-        for node_j in nodes[node_i.id+1:]:
-            savings.append((node_i, node_j, compute_savings(node_i, node_j, depot, dist_matrix)))
 
-    savings.sort(key = lambda x: x[2], reverse=True)
+def merge_savings(nodes, savings_pairs, vehicle_capacity, dist_matrix, stats=None):
+    # Build routes by consuming (i, j) pairs in the given order
+    savings_pairs = counted(savings_pairs, stats, "savings consumed")
+    depot = nodes[0]
+    for node in nodes:
+        node.route = None
+        node.is_interior = False
 
     routes = []
 
-    while len(savings) > 0:
-        node_i, node_j, _ = savings.pop(0)
+    for i, j in savings_pairs:
+        node_i = nodes[i]
+        node_j = nodes[j]
         if node_i.route == None and node_j.route == None:
             # Create new route
             if node_i.demand + node_j.demand <= vehicle_capacity:
@@ -138,13 +183,44 @@ def cws_algorithm(instance_name, vehicle_capacity, print_sols=False):
                     routes.append(new_route)
                     node_i.is_interior = True
                     node_j.is_interior = True
-                    for nodes in node_i.route.edges:
-                        if nodes[0] != depot:
-                            nodes[0].route = new_route
-                    for nodes in node_j.route.edges:
-                        if nodes[0] != depot:
-                            nodes[0].route = new_route
+                    for edge in node_i.route.edges:
+                        if edge[0] != depot:
+                            edge[0].route = new_route
+                    for edge in node_j.route.edges:
+                        if edge[0] != depot:
+                            edge[0].route = new_route
+
+    return routes
+
+
+def cws_algorithm(instance_name, vehicle_capacity, print_sols=False, num_neighbors=None, stats=None, condensed=False):
+    start = time.time()
+    lap = laps(stats)
+
+    nodes = load_cvrp_instance(instance_name)
+    lap("load")
+
+    num_nodes = len(nodes)
+
+    depot = nodes[0]
+
+    if num_neighbors is None:
+        # Distance Matrix, computed once per file and then read from the
+        # cache. condensed keeps only the upper triangle in float32.
+        dist_matrix = load_dist_matrix(cvrp_file_name(instance_name), CVRP, condensed=condensed)
+        lap("distance matrix")
+
+        # Compute Savings List
+        savings = compute_savings_list(nodes, depot, dist_matrix)
+    else:
+        # Granular mode: no matrix, savings of nearby customers only
+        dist_matrix = CoordinateDistances(node_coords(nodes))
+        lap("distance matrix")
+        savings = compute_granular_savings_list(nodes, depot, dist_matrix, num_neighbors)
+    lap("savings")
 
+    routes = merge_savings(nodes, iter_savings(savings), vehicle_capacity, dist_matrix, stats)
+    lap("merge")
 
     total_cost = 0
     for route in routes:
@@ -156,6 +232,62 @@ def cws_algorithm(instance_name, vehicle_capacity, print_sols=False):
 
     return total_cost, len(routes), num_nodes, end-start
 
+
+def _cws_multistart_worker(args):
+    instance_name, vehicle_capacity, beta, seed, max_starts, time_limit, include_classic, condensed = args
+    start = time.time()
+    rng = random.Random(seed)
+    nodes = load_cvrp_instance(instance_name)
+    dist_matrix = load_dist_matrix(cvrp_file_name(instance_name), CVRP, condensed=condensed)
+    savings = compute_savings_list(nodes, nodes[0], dist_matrix)
+
+    best_cost = float("inf")
+    best_routes = []
+    num_starts = 0
+    while (max_starts is None or num_starts < max_starts) and (time_limit is None or time.time() - start < time_limit):
+        if include_classic and num_starts == 0:
+            savings_pairs = iter_savings(savings)
+        else:
+            savings_pairs = iter_biased_savings(savings, beta, rng)
+        routes = merge_savings(nodes, savings_pairs, vehicle_capacity, dist_matrix)
+        num_starts += 1
+        total_cost = sum(compute_route_cost(route, dist_matrix) for route in routes)
+        if total_cost < best_cost:
+            best_cost = total_cost
+            best_routes = [[(edge[0].id, edge[1].id) for edge in route.edges] for route in routes]
+    return float(best_cost), best_routes, num_starts
+
+
+def cws_multistart(instance_name, vehicle_capacity, max_starts=1000, time_limit=None, beta=0.3, workers=4, seed=0, condensed=False):
+    # Biased-randomized CWS spread over worker processes. Worker w draws
+    # from its own stream seeded from (seed, w) and runs an equal share of
+    # max_starts, so an iteration budget gives the same result on every
+    # run. The first start of worker 0 is the classic deterministic CWS.
+    # Routes are returned as lists of (node id, node id) edges.
+    if not 0 < beta < 1:
+        raise ValueError(f"beta must be strictly between 0 and 1, got {beta}")
+    if max_starts is None and time_limit is None:
+        raise ValueError("max_starts and time_limit cannot both be None")
+    start = time.time()
+    jobs = [(instance_name, vehicle_capacity, beta, int(worker_seed.generate_state(1)[0]), worker_starts, time_limit, worker == 0, condensed)
+            for worker, (worker_starts, worker_seed) in enumerate(split_work(max_starts, workers, seed))]
+    results = map_workers(_cws_multistart_worker, jobs)
+
+    best_cost, best_routes, _ = best_result(results)
+    num_starts = sum(result[2] for result in results)
+    end = time.time()
+
+    return best_cost, best_routes, num_starts, end-start
+
+
+def granular_gap_report(instances, num_neighbors):
+    print(f"Instance,# nodes,vCap,CWS Sol.,Granular CWS Sol. (k={num_neighbors}),GAP (%),Time (s),Granular Time (s)")
+    for instance in instances:
+        total_cost, _, num_nodes, time_taken = cws_algorithm(instance[0], instance[1], False)
+        granular_cost, _, _, granular_time = cws_algorithm(instance[0], instance[1], False, num_neighbors)
+        gap = 100 * (granular_cost - total_cost) / total_cost
+        print(f"{instance[0]},{num_nodes},{instance[1]},{total_cost:.2f},{granular_cost:.2f},{gap:.2f},{time_taken:.3f},{granular_time:.3f}")
+
 if __name__ == "__main__":
     instances = [
         ('A-n32-k5', 100.0),
@@ -193,7 +325,12 @@ if __name__ == "__main__":
         ('P-n101-k4', 400.0),
     ]
 
+    num_neighbors = 20
+
     print("Instance,# nodes,vCap,CWS Sol.,# routes, Time (s)")
     for instance in instances:
         total_cost, num_routes, num_nodes, time_taken = cws_algorithm(instance[0], instance[1], False)
         print(f"{instance[0]},{num_nodes},{instance[1]},{total_cost:.2f},{num_routes},{time_taken:.3f}")
+
+    print("")
+    granular_gap_report(instances, num_neighbors)
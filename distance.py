@@ -0,0 +1,233 @@
+import math
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class DistanceMatrix:
+    def __init__(self, coords, condensed=False, dtype=None, block_size=1024):
+        coords = np.asarray(coords, dtype=np.float64)
+        self.n = len(coords)
+        self.condensed = condensed
+        if dtype is None:
+            dtype = np.float32 if condensed else np.float64
+        self.dtype = np.dtype(dtype)
+
+        if condensed:
+            # Upper triangle (i < j) stored row by row in a flat array
+            self.data = np.empty(self.n * (self.n - 1) // 2, dtype=self.dtype)
+            offset = 0
+            for i in range(self.n - 1):
+                row = _euclidean(coords[i:i+1], coords[i+1:])[0]
+                self.data[offset:offset+len(row)] = row
+                offset += len(row)
+        else:
+            # Full matrix built in blocks of rows to bound the temporaries
+            self.data = np.empty((self.n, self.n), dtype=self.dtype)
+            for start in range(0, self.n, block_size):
+                end = min(start + block_size, self.n)
+                self.data[start:end] = _euclidean(coords[start:end], coords)
+
+    @classmethod
+    def from_array(cls, data, condensed=False):
+        # Wrap an already computed full or condensed array without copying
+        dist_matrix = cls.__new__(cls)
+        dist_matrix.data = data
+        dist_matrix.condensed = condensed
+        dist_matrix.dtype = data.dtype
+        if condensed:
+            dist_matrix.n = int(round((1 + math.sqrt(1 + 8*len(data))) / 2))
+        else:
+            dist_matrix.n = len(data)
+        return dist_matrix
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if not self.condensed:
+            return self.data[key]
+        if isinstance(key, tuple):
+            i, j = key
+            if isinstance(i, np.ndarray) or isinstance(j, np.ndarray):
+                return self._lookup(np.asarray(i), np.asarray(j))
+            if i == j:
+                return self.dtype.type(0)
+            if i > j:
+                i, j = j, i
+            return self.data[self._offset(i) + j - i - 1]
+        return self.row(key)
+
+    def _offset(self, i):
+        return i * self.n - i * (i + 1) // 2
+
+    def _lookup(self, i, j):
+        low = np.minimum(i, j).astype(np.int64)
+        high = np.maximum(i, j).astype(np.int64)
+        index = low * self.n - low * (low + 1) // 2 + high - low - 1
+        values = self.data[np.where(low == high, 0, index)]
+        return np.where(low == high, 0, values).astype(self.dtype)
+
+    def row(self, i):
+        if not self.condensed:
+            return self.data[i]
+        row = np.empty(self.n, dtype=self.dtype)
+        if i > 0:
+            # Column i of the rows above it
+            above = np.arange(i)
+            row[:i] = self.data[above * self.n - above * (above + 1) // 2 + i - above - 1]
+        row[i] = 0
+        offset = self._offset(i)
+        row[i+1:] = self.data[offset:offset + self.n - i - 1]
+        return row
+
+    def full(self):
+        if not self.condensed:
+            return self.data
+        full = np.zeros((self.n, self.n), dtype=self.dtype)
+        rows, cols = np.triu_indices(self.n, k=1)
+        full[rows, cols] = self.data
+        full[cols, rows] = self.data
+        return full
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+
+class CoordinateDistances:
+    # Same indexing as DistanceMatrix but nothing is stored, each distance
+    # is computed from the coordinates when asked for
+    condensed = False
+
+    def __init__(self, coords):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.n = len(self.coords)
+        self.xs = self.coords[:, 0].tolist()
+        self.ys = self.coords[:, 1].tolist()
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            i, j = key
+            if isinstance(i, np.ndarray) or isinstance(j, np.ndarray):
+                diff = self.coords[i] - self.coords[j]
+                return np.sqrt(diff[..., 0]*diff[..., 0] + diff[..., 1]*diff[..., 1])
+            dx = self.xs[i] - self.xs[j]
+            dy = self.ys[i] - self.ys[j]
+            return math.sqrt(dx*dx + dy*dy)
+        return self.row(key)
+
+    def row(self, i):
+        return _euclidean(self.coords[i:i+1], self.coords)[0]
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes
+
+
+def _euclidean(coords_a, coords_b):
+    dx = coords_a[:, 0, None] - coords_b[None, :, 0]
+    dy = coords_a[:, 1, None] - coords_b[None, :, 1]
+    return np.sqrt(dx*dx + dy*dy)
+
+
+def node_coords(nodes):
+    return np.array([(node.x, node.y) for node in nodes], dtype=np.float64)
+
+
+def build_dist_matrix(nodes, condensed=False, dtype=None):
+    if isinstance(nodes, np.ndarray):
+        coords = nodes
+    else:
+        coords = node_coords(nodes)
+    return DistanceMatrix(coords, condensed, dtype)
+
+
+def share_dist_matrix(dist_matrix):
+    # Copy the matrix into a new shared memory block. Returns the block,
+    # which the caller must close and unlink, and a small picklable spec
+    # that attach_dist_matrix turns back into a matrix in another process.
+    shm = shared_memory.SharedMemory(create=True, size=max(dist_matrix.data.nbytes, 1))
+    data = np.ndarray(dist_matrix.data.shape, dtype=dist_matrix.data.dtype, buffer=shm.buf)
+    data[...] = dist_matrix.data
+    return shm, (shm.name, dist_matrix.data.shape, dist_matrix.data.dtype.str, dist_matrix.condensed)
+
+
+def attach_dist_matrix(spec):
+    # Keep the returned block referenced for as long as the matrix is used
+    name, shape, dtype, condensed = spec
+    shm = shared_memory.SharedMemory(name=name)
+    data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, DistanceMatrix.from_array(data, condensed)
+
+
+def nearest_neighbors(dist_matrix, k, block_size=1024):
+    # k closest cities of every city, sorted by distance
+    n = len(dist_matrix)
+    k = min(k, n - 1)
+    neighbors = np.empty((n, k), dtype=np.int32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        if isinstance(dist_matrix, DistanceMatrix) and not dist_matrix.condensed:
+            block = np.array(dist_matrix.data[start:end], dtype=np.float64)
+        else:
+            block = np.array([dist_matrix.row(i) for i in range(start, end)], dtype=np.float64)
+        rows = np.arange(end - start)
+        block[rows, rows + start] = np.inf
+        closest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(block[rows[:, None], closest], axis=1, kind="stable")
+        neighbors[start:end] = closest[rows[:, None], order]
+    return neighbors
+
+
+def nearest_points(coords, k, points_per_cell=2):
+    # k closest points of every point, sorted by distance, found through a
+    # uniform grid so that no n x n block is ever built
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    k = min(k, n - 1)
+    low = coords.min(axis=0)
+    span = max(float(np.max(coords.max(axis=0) - low)), 1e-12)
+    side = max(1, int(math.sqrt(n / points_per_cell)))
+    cell_size = span / side
+    cells = np.minimum(((coords - low) / cell_size).astype(np.int64), side - 1)
+    cell_ids = cells[:, 0] * side + cells[:, 1]
+    order = np.argsort(cell_ids, kind="stable")
+    bounds = np.searchsorted(cell_ids[order], np.arange(side * side + 1))
+
+    neighbors = np.empty((n, k), dtype=np.int32)
+    for cell_id in np.unique(cell_ids).tolist():
+        cx, cy = divmod(cell_id, side)
+        members = order[bounds[cell_id]:bounds[cell_id + 1]]
+        points = coords[members]
+        radius = 1
+        while True:
+            x0, x1 = max(cx - radius, 0), min(cx + radius, side - 1)
+            y0, y1 = max(cy - radius, 0), min(cy + radius, side - 1)
+            # Cells of one grid column are contiguous in the sorted order
+            candidates = np.concatenate([order[bounds[x*side + y0]:bounds[x*side + y1 + 1]] for x in range(x0, x1 + 1)])
+            if len(candidates) > k:
+                dist = _euclidean(points, coords[candidates])
+                dist[members[:, None] == candidates[None, :]] = np.inf
+                closest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                rows = np.arange(len(members))[:, None]
+                kth = dist[rows, closest].max(axis=1)
+                # Points outside the searched square are at least this far
+                margin = np.full(len(members), np.inf)
+                if x0 > 0:
+                    margin = np.minimum(margin, points[:, 0] - (low[0] + x0*cell_size))
+                if x1 < side - 1:
+                    margin = np.minimum(margin, low[0] + (x1 + 1)*cell_size - points[:, 0])
+                if y0 > 0:
+                    margin = np.minimum(margin, points[:, 1] - (low[1] + y0*cell_size))
+                if y1 < side - 1:
+                    margin = np.minimum(margin, low[1] + (y1 + 1)*cell_size - points[:, 1])
+                if np.all(kth <= margin):
+                    sorted_closest = np.argsort(dist[rows, closest], axis=1, kind="stable")
+                    neighbors[members] = candidates[closest[rows, sorted_closest]]
+                    break
+            radius += 1
+    return neighbors
@@ -1,149 +1,164 @@
-import math
 import random
-
-class Node:
-    def __init__(self, id, x, y):
-        self.id = id
-        self.x = x
-        self.y = y
-        
-    def __str__(self) -> str:
-        return str(self.id)
-    
-    def __repr__(self) -> str:
-        return str(self.id)
-    
-class Route:
-    def __init__(self):
-        self.edges = []
-        self.cost = 0.0
-
-    def recompute_cost(self, dist_matrix):
-        self.cost = 0.0
-        for edge in self.edges:
-            self.cost += dist_matrix[edge[0].id][edge[1].id]
-        return self.cost
-
-    def __str__(self) -> str:
-        return f"{self.edges} -> Cost: {self.cost:.2f}" 
-    
-    def __repr__(self) -> str:
-        return str(self.edges)
-
-def dist(node_1: Node, node_2: Node):
-    return math.sqrt((node_1.x - node_2.x)**2 + (node_1.y - node_2.y)**2)
-
-def get_greedy_random_solution(original_nodes, dist_matrix):
-    nodes = original_nodes.copy()
-    route = Route()
-    starting_node = nodes.pop(random.randint(0, len(nodes)-1))
-
-    while len(nodes) > 0:
-        elements_distance = []
-        max_distance = 0
-        for node in nodes:
-            node_distance = dist_matrix[starting_node.id][node.id]
-            elements_distance.append((node, node_distance))
-            if node_distance > max_distance:
-                max_distance = node_distance
-
-        # Pure Greedy
-        # elements_distance.sort(key = lambda x: x[1], reverse=False)
-        # random_node = elements_distance[0][0]
-        
-        # Greedy Random
-        possible_nodes = []
-        probabilities = []
-        for elem in elements_distance:
-            possible_nodes.append(elem[0])
-            probabilities.append(1-(elem[1]/(max_distance+1)))
-
-        if probabilities == [0.0]:
-            random_node = nodes[0]
+import time
+import numpy as np
+from distance import nearest_neighbors, share_dist_matrix, attach_dist_matrix
+from loader import load_dist_matrix, TSP
+from local_search import two_opt, build_reverse_neighbors
+from tour import Tour
+from instrumentation import laps, stream_item
+from budget import Budget, STOPPED, improves
+from parallel import split_work, map_workers, best_result
+
+def get_rcl_solution(dist_matrix, rng, rcl_size=None, rcl_alpha=None, stats=None):
+    # Greedy random construction over a visited mask and NumPy rows, from
+    # a random first city. The restricted candidate list holds the rcl_size
+    # closest unvisited cities, or those within rcl_alpha of the min-max
+    # distance range, or all of them when neither is given. The next city
+    # is drawn from it with weights 1 - d/(max d + 1).
+    n = len(dist_matrix)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int32)
+    current = int(rng.integers(n))
+    order[0] = current
+    visited[current] = True
+
+    for step in range(1, n):
+        distances = np.where(visited, np.inf, dist_matrix.row(current))
+        remaining = n - step
+        if rcl_size is not None and rcl_size < remaining:
+            candidates = np.argpartition(distances, rcl_size - 1)[:rcl_size]
         else:
-            random_node = random.choices(possible_nodes, weights = probabilities, k=1)[0]
-
-        route.edges.append((starting_node, random_node))
-        route.cost += dist_matrix[starting_node.id][random_node.id]
-        nodes.remove(random_node)
-        starting_node = random_node
-
-    route.edges.append((route.edges[-1][1], route.edges[0][0]))
-    return route
-
-def local_search_2_opt(route, dist_matrix, max_iters = 1000):
-    num_iters = 0
-    best_route = Route()
-    best_route.edges = route.edges
-    best_route.cost = route.cost
-    while num_iters < max_iters:
-        num_iters += 1
-        x = 0
-        y = 0
-        while x < len(route.edges):
-            while y < len(route.edges):
-                edge_1 = route.edges[x]
-                edge_2 = route.edges[y]
-                if edge_1 != edge_2 and edge_1[1] != edge_2[0]:
-                    # Swap routes
-                    new_route = Route()
-                    new_route.edges = route.edges.copy()
-                    new_route.edges[x] = (edge_1[0], edge_2[0])
-                    new_route.edges[y] = (edge_1[1], edge_2[1])
-                    
-                    # Reverse edges between them
-                    edges_between_them = new_route.edges[x+1:y]
-                    edges_between_them.reverse()
-                    for k in range(len(edges_between_them)):
-                        edges_between_them[k] = (edges_between_them[k][1], edges_between_them[k][0])
-                    new_route.edges[x+1:y] = edges_between_them
-
-                    # Recompute costs
-                    if new_route.recompute_cost(dist_matrix) < route.cost:
-                        route = new_route 
-                y += 1
-            x += 1
-        if route.cost < best_route.cost:
-            best_route = Route()
-            best_route.edges = route.edges.copy()
-            best_route.cost = route.cost
+            candidates = np.flatnonzero(~visited)
+            if rcl_alpha is not None:
+                low = distances[candidates].min()
+                high = distances[candidates].max()
+                candidates = candidates[distances[candidates] <= low + rcl_alpha*(high - low)]
+        candidate_distances = distances[candidates]
+        weights = np.cumsum(1 - candidate_distances/(candidate_distances.max() + 1))
+        if weights[-1] > 0:
+            current = int(candidates[np.searchsorted(weights, rng.random()*weights[-1], side="right")])
         else:
-            break
-    return best_route
+            current = int(candidates[0])
+        order[step] = current
+        visited[current] = True
+
+    return Tour(order, dist_matrix, stats)
+
+def grasp_tsp_stream(filename, max_iterations=1000, num_neighbors=10, rcl_size=None, rcl_alpha=None, seed=None, stats=None, budget=None, condensed=False):
+    # Anytime GRASP, see stream_item. The first item is the greedy random tour.
+    start = time.time()
+    budget = (Budget() if budget is None else budget).start()
+    lap = laps(stats)
+
+    # Distance Matrix, computed once per file and then read from the
+    # cache together with the instance
+    dist_matrix = load_dist_matrix(filename, TSP, condensed=condensed)
+    neighbors = nearest_neighbors(dist_matrix, num_neighbors)
+    reverse_neighbors = build_reverse_neighbors(neighbors)
+    lap("distance matrix")
+    # Without a seed the stream follows random.seed
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+
+    try:
+        greedy_sol = get_rcl_solution(dist_matrix, rng, rcl_size, rcl_alpha, stats)
+        budget.add_evaluations()
+        lap("construction")
+        yield from stream_item(start, 0, greedy_sol, stats)
+        local_search_solution = two_opt(greedy_sol.copy(), dist_matrix, neighbors, reverse_neighbors=reverse_neighbors, stats=stats, budget=budget)
+        lap("local search")
+
+        best_sol = local_search_solution
+        if best_sol.cost < greedy_sol.cost:
+            yield from stream_item(start, 0, best_sol, stats)
+
+        for i in budget.iterations(max_iterations):
+            new_greedy_sol = get_rcl_solution(dist_matrix, rng, rcl_size, rcl_alpha, stats)
+            budget.add_evaluations()
+            lap("construction")
+            local_search_solution = two_opt(new_greedy_sol, dist_matrix, neighbors, reverse_neighbors=reverse_neighbors, stats=stats, budget=budget)
+            lap("local search")
+            improved = improves(local_search_solution.cost, best_sol.cost)
+            budget.end_iteration(improved)
+            if improved:
+                best_sol = local_search_solution
+                yield from stream_item(start, i+1, best_sol, stats)
+    finally:
+        budget.finish(STOPPED)
+
+
+def grasp_tsp_algorithm(filename, max_iterations=1000, num_neighbors=10, rcl_size=None, rcl_alpha=None, seed=None, stats=None, budget=None, condensed=False):
+    start = time.time()
+
+    # The first tour of the stream is the greedy random one
+    greedy_sol = None
+    for _, _, _, best_sol in grasp_tsp_stream(filename, max_iterations, num_neighbors, rcl_size, rcl_alpha, seed, stats, budget, condensed):
+        if greedy_sol is None:
+            greedy_sol = best_sol
+
+    end = time.time()
+
+    return greedy_sol, best_sol, end-start
+
+
+_grasp_worker_state = None
+
+
+def _init_grasp_worker(spec, neighbors):
+    global _grasp_worker_state
+    shm, dist_matrix = attach_dist_matrix(spec)
+    _grasp_worker_state = (shm, dist_matrix, neighbors, build_reverse_neighbors(neighbors))
+
+
+def _grasp_worker(args):
+    iterations, seed, rcl_size, rcl_alpha = args
+    _, dist_matrix, neighbors, reverse_neighbors = _grasp_worker_state
+    rng = np.random.default_rng(seed)
+    best_sol = None
+    for i in range(iterations):
+        local_search_solution = two_opt(get_rcl_solution(dist_matrix, rng, rcl_size, rcl_alpha), dist_matrix, neighbors, reverse_neighbors=reverse_neighbors)
+        if best_sol is None or local_search_solution.cost < best_sol.cost:
+            best_sol = local_search_solution
+    # Only the best tour goes back to the parent
+    return float(best_sol.cost), best_sol.order
+
+
+def parallel_grasp(filename, max_iterations=1000, num_neighbors=10, rcl_size=None, rcl_alpha=None, workers=4, seed=0, condensed=False):
+    # GRASP iterations split evenly over worker processes. The distance
+    # matrix is placed in shared memory once and every worker maps it
+    # instead of receiving a copy. Worker w draws from its own stream
+    # spawned from seed, so the result only depends on seed and workers.
+    # Returns the best tour and the best cost found by each worker.
+    if max_iterations is None:
+        raise ValueError("parallel_grasp needs max_iterations, it has no other limit")
+    start = time.time()
+
+    dist_matrix = load_dist_matrix(filename, TSP, condensed=condensed)
+    neighbors = nearest_neighbors(dist_matrix, num_neighbors)
+
+    jobs = [(iterations, worker_seed, rcl_size, rcl_alpha) for iterations, worker_seed in split_work(max_iterations, workers, seed)]
 
+    shm, spec = share_dist_matrix(dist_matrix)
+    try:
+        results = map_workers(_grasp_worker, jobs, _init_grasp_worker, (spec, neighbors))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    _, best_order = best_result(results)
+    best_sol = Tour(best_order, dist_matrix)
+    end = time.time()
+
+    return best_sol, [result[0] for result in results], end-start
 
-    
 
 if __name__ == "__main__":
 
     filename = "berlin52.txt"
 
-    # Load file
-    with open(filename) as instance:
-        nodes = []
-        for line in instance:
-            data = [x for x in line.split()]
-            node = Node(int(data[0])-1, float(data[1]), float(data[2]))
-            nodes.append(node)
-
-    # Compute Distance Matrix
-    dist_matrix = [[0]*len(nodes) for _ in range(len(nodes))]
-    for i, node_1 in enumerate(nodes):
-        for j, node_2 in enumerate(nodes):
-            if i<j:
-                dist_matrix[i][j] = dist(node_1, node_2)
-                dist_matrix[j][i] = dist_matrix[i][j]
-
-    greedy_sol = get_greedy_random_solution(nodes, dist_matrix)
-    local_search_solution = local_search_2_opt(greedy_sol, dist_matrix)
-
-    best_sol = local_search_solution
-
-    for i in range(1000):
-        greedy_sol = get_greedy_random_solution(nodes, dist_matrix)
-        local_search_solution = local_search_2_opt(greedy_sol, dist_matrix)
-        if local_search_solution.cost < best_sol.cost:
-            best_sol = local_search_solution
+    max_iterations = 1000
+    num_neighbors = 10
+
+    greedy_sol, best_sol, _ = grasp_tsp_algorithm(filename, max_iterations, num_neighbors)
 
     print("Instance Name: "+filename.split(".")[0])
     print("-------------------------------------")
@@ -151,4 +166,9 @@ if __name__ == "__main__":
     print(greedy_sol)
     print("-------------------------------------")
     print("GRASP solution")
-    print(best_sol)
\ No newline at end of file
+    print(best_sol)
+    print("-------------------------------------")
+    print("Parallel GRASP solution")
+    best_sol, worker_costs, time_taken = parallel_grasp(filename, max_iterations, num_neighbors)
+    print(best_sol)
+    print(f"Worker best costs: {[round(cost, 2) for cost in worker_costs]}, Time (s): {time_taken:.3f}")
@@ -1,5 +1,11 @@
-import math
 import random
+import time
+from distance import nearest_neighbors
+from loader import load_instance, load_dist_matrix, TSP
+from local_search import local_search, build_reverse_neighbors, TWO_OPT, OR_OPT
+from tour import Tour
+from instrumentation import laps, stream_item
+from budget import Budget, STOPPED, improves
 
 class Node:
     def __init__(self, id, x, y):
@@ -22,156 +28,113 @@ class Node:
     def __hash__(self):
         return hash((self.id, self.x, self.y))
     
-class Route:
-    def __init__(self):
-        self.edges = []
-        self.cost = 0.0
-
-    def recompute_cost(self, dist_matrix):
-        self.cost = 0.0
-        for edge in self.edges:
-            self.cost += dist_matrix[edge[0].id][edge[1].id]
-        return self.cost
-
-    def __str__(self) -> str:
-        return f"{self.edges} -> Cost: {self.cost:.2f}" 
-    
-    def __repr__(self) -> str:
-        return str(self.edges)
-    
-    def has_duplicates(self, nodes):
-        route_nodes = []
-        for edge in self.edges:
-            route_nodes.append(edge[0])
-        route_nodes.append(self.edges[-1][1])
-
-        route_nodes.sort()
-        original_nodes = nodes.copy()
-        original_nodes.sort()
-
-        return route_nodes != original_nodes
-
-
-def dist(node_1: Node, node_2: Node):
-    return math.sqrt((node_1.x - node_2.x)**2 + (node_1.y - node_2.y)**2)
-
-def local_search_2_opt(route, dist_matrix, max_iters = 50):
-    num_iters = 0
-    best_route = Route()
-    best_route.edges = route.edges.copy()
-    best_route.cost = route.cost
-    while num_iters < max_iters:
-        num_iters += 1
-        x = 0
-        y = 0
-        while x < len(route.edges):
-            while y < len(route.edges):
-                edge_1 = route.edges[x]
-                edge_2 = route.edges[y]
-                if edge_1 != edge_2 and edge_1[1] != edge_2[0]:
-                    # Swap routes
-                    new_route = Route()
-                    new_route.edges = route.edges.copy()
-                    new_route.edges[x] = (edge_1[0], edge_2[0])
-                    new_route.edges[y] = (edge_1[1], edge_2[1])
-                    
-                    # Reverse edges between them
-                    edges_between_them = new_route.edges[x+1:y]
-                    edges_between_them.reverse()
-                    for k in range(len(edges_between_them)):
-                        edges_between_them[k] = (edges_between_them[k][1], edges_between_them[k][0])
-                    new_route.edges[x+1:y] = edges_between_them
-
-                    # Recompute costs
-                    if new_route.recompute_cost(dist_matrix) < route.cost:
-                        route = new_route 
-                y += 1
-            x += 1
-        if route.cost < best_route.cost:
-            best_route = Route()
-            best_route.edges = route.edges.copy()
-            best_route.cost = route.cost
-            num_iters = 0
-        else:
-            break
-    return best_route
-
-def construct_initial_solution(nodes, dist_matrix):
+def construct_initial_solution(nodes, dist_matrix, stats=None):
     random.shuffle(nodes)
-    route = Route()
-    for i in range(len(nodes)-1):
-        route.edges.append((nodes[i], nodes[i+1]))
-        route.cost += dist_matrix[nodes[i].id][nodes[i+1].id]
-    return route
+    return Tour([node.id for node in nodes], dist_matrix, stats)
 
 def perturbation(route, dist_matrix, random_segments=4):
+    # Returns the new route, the cities whose edges changed (the shuffled
+    # ones and the two around them) and the cost delta
 
-    new_route = Route()
-    new_route.edges = route.edges.copy()
+    new_route = route.copy()
 
-    start_index = random.randint(0, len(new_route.edges)-(1+random_segments))
+    start_index = random.randint(0, new_route.n-(1+random_segments))
 
-    nodes = set()
-    for i in range(random_segments):
-        nodes.add(new_route.edges[start_index+i][0])
-        nodes.add(new_route.edges[start_index+i][1])
-    
-    new_nodes = list(nodes)
+    new_nodes = new_route.order[start_index:start_index+random_segments+1].tolist()
 
     random.shuffle(new_nodes)
 
-    for i in range(len(new_nodes)-1):
-        new_route.edges[start_index+i] = (new_nodes[i], new_nodes[i+1])
+    new_route.replace_segment(start_index, new_nodes, dist_matrix)
 
-    if start_index > 0:
-        new_route.edges[start_index-1] = (new_route.edges[start_index-1][0], new_nodes[0])
-
-    if start_index+random_segments < len(new_route.edges):
-        new_route.edges[start_index+random_segments] = (new_nodes[-1], new_route.edges[start_index+random_segments][1])
-        
-    new_route.recompute_cost(dist_matrix)
+    touched = [new_route.city(start_index-1)] + new_nodes + [new_route.city(start_index+random_segments+1)]
 
-    return new_route
+    return new_route, touched, new_route.cost - route.cost
     
 
+def ils_tsp_stream(filename, max_iterations=10000, num_neighbors=10, moves=(TWO_OPT, OR_OPT), localized=True, stats=None, budget=None, condensed=False):
+    # Anytime ILS, see stream_item. The first item is the initial random tour.
+    start = time.time()
+    budget = (Budget() if budget is None else budget).start()
+    lap = laps(stats)
+
+    # Load file
+    coords = load_instance(filename, TSP)["coords"]
+    nodes = [Node(i, x, y) for i, (x, y) in enumerate(coords.tolist())]
+    lap("load")
+
+    # Distance Matrix, computed once per file and then read from the cache
+    dist_matrix = load_dist_matrix(filename, TSP, condensed=condensed)
+    neighbors = nearest_neighbors(dist_matrix, num_neighbors)
+    reverse_neighbors = build_reverse_neighbors(neighbors)
+    lap("distance matrix")
+
+    try:
+        initial_sol = construct_initial_solution(nodes, dist_matrix, stats)
+        budget.add_evaluations()
+        lap("construction")
+        yield from stream_item(start, 0, initial_sol, stats)
+        local_search_solution = local_search(initial_sol.copy(), dist_matrix, neighbors, moves, reverse_neighbors=reverse_neighbors, stats=stats, budget=budget)
+        lap("local search")
+
+        best_sol = local_search_solution
+        if best_sol.cost < initial_sol.cost:
+            yield from stream_item(start, 0, best_sol, stats)
+
+        for i in budget.iterations(max_iterations):
+            new_sol, touched, _ = perturbation(best_sol, dist_matrix, 4)
+            budget.add_evaluations()
+            lap("perturbation")
+            # best_sol is a local optimum, so only moves from the perturbed
+            # cities or from cities having them as candidates can improve it.
+            # Without localized every city is rescanned.
+            active = None
+            if localized:
+                active = list(dict.fromkeys(touched + [other for city in touched for other in reverse_neighbors[city]]))
+            new_sol = local_search(new_sol, dist_matrix, neighbors, moves, active, reverse_neighbors=reverse_neighbors, stats=stats, budget=budget)
+            lap("local search")
+            improved = improves(new_sol.cost, best_sol.cost)
+            budget.end_iteration(improved)
+            if improved:
+                best_sol = new_sol
+                yield from stream_item(start, i+1, best_sol, stats)
+    finally:
+        budget.finish(STOPPED)
+
+
+def ils_tsp_algorithm(filename, max_iterations=10000, num_neighbors=10, moves=(TWO_OPT, OR_OPT), localized=True, stats=None, budget=None, condensed=False):
+    start = time.time()
+
+    # The first tour of the stream is the initial random one
+    initial_sol = None
+    for _, _, _, best_sol in ils_tsp_stream(filename, max_iterations, num_neighbors, moves, localized, stats, budget, condensed):
+        if initial_sol is None:
+            initial_sol = best_sol
+
+    end = time.time()
+
+    return initial_sol, best_sol, end-start
+
+
 if __name__ == "__main__":
 
     filename = "berlin52.txt"
 
     max_iterations = 10000
-    max_no_improve_iterations = 1000
+    num_neighbors = 10
+    moves = (TWO_OPT, OR_OPT)
+
+    initial_sol, best_sol, _ = ils_tsp_algorithm(filename, max_iterations, num_neighbors, moves)
 
-    # Load file
-    with open(filename) as instance:
-        nodes = []
-        for line in instance:
-            data = [x for x in line.split()]
-            node = Node(int(data[0])-1, float(data[1]), float(data[2]))
-            nodes.append(node)
-
-    # Compute Distance Matrix
-    dist_matrix = [[0]*len(nodes) for _ in range(len(nodes))]
-    for i, node_1 in enumerate(nodes):
-        for j, node_2 in enumerate(nodes):
-            if i<j:
-                dist_matrix[i][j] = dist(node_1, node_2)
-                dist_matrix[j][i] = dist_matrix[i][j]
-
-    initial_sol = construct_initial_solution(nodes, dist_matrix)
-    local_search_solution = local_search_2_opt(initial_sol, dist_matrix, max_no_improve_iterations)
-
-    best_sol = local_search_solution
-
-    for i in range(max_iterations):
-        new_sol = perturbation(best_sol, dist_matrix, 4)
-        new_sol = local_search_2_opt(new_sol, dist_matrix, max_no_improve_iterations)
-        if new_sol.cost < best_sol.cost:
-            best_sol = new_sol
-        
     print("Instance Name: "+filename.split(".")[0])
     print("-------------------------------------")
     print("Initial Random solution")
     print(initial_sol)
     print("-------------------------------------")
     print("ILS solution")
-    print(best_sol)
\ No newline at end of file
+    print(best_sol)
+    print("-------------------------------------")
+    print("ILS convergence within 2 seconds or 500 iterations without a new best")
+    budget = Budget(time_limit=2, max_stagnation=500)
+    for elapsed, iteration, cost, _ in ils_tsp_stream(filename, None, num_neighbors, moves, budget=budget):
+        print(f"{elapsed:.3f} s, iteration {iteration}: {cost:.2f}")
+    print(budget)
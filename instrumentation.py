@@ -0,0 +1,68 @@
+import time
+
+
+class Stats:
+    # Wall time per phase and named counters of one solver run. Solvers
+    # take stats=None and only record anything when given one.
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self.last_lap = time.perf_counter()
+
+    def add(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def lap(self, name):
+        # The time since the previous lap goes to phase name
+        now = time.perf_counter()
+        self.timings[name] = self.timings.get(name, 0.0) + now - self.last_lap
+        self.last_lap = now
+
+    def as_dict(self):
+        return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+    def __str__(self) -> str:
+        lines = [f"{name}: {seconds:.4f} s" for name, seconds in self.timings.items()]
+        lines += [f"{name}: {count}" for name, count in self.counters.items()]
+        return "\n".join(lines)
+
+
+def laps(stats):
+    # Phase clock started now: call lap(name) at the end of each phase.
+    # When stats is None lap does nothing.
+    if stats is None:
+        return _no_lap
+    stats.last_lap = time.perf_counter()
+    return stats.lap
+
+
+def _no_lap(name):
+    pass
+
+
+def stream_item(start, iteration, tour, stats):
+    # One item of an anytime solver stream: (elapsed time since start,
+    # iteration, best cost, best tour). Streams yield one for their first
+    # tour and one per new best, and stop early when the consumer stops
+    # iterating. The phase clock restarts when the next item is asked for,
+    # so time spent by the consumer goes to no phase.
+    yield time.time() - start, iteration, tour.cost, tour
+    laps(stats)
+
+
+def counted(iterable, stats, name):
+    # Count the items taken from iterable. When stats is None the iterable
+    # itself is returned, so a disabled counter adds nothing to the loop.
+    if stats is None:
+        return iterable
+    return _counted(iterable, stats, name)
+
+
+def _counted(iterable, stats, name):
+    count = 0
+    try:
+        for item in iterable:
+            count += 1
+            yield item
+    finally:
+        stats.add(name, count)
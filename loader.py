@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from distance import DistanceMatrix
+
+CACHE_DIR = ".instance_cache"
+
+TSP = "tsp"
+CVRP = "cvrp"
+TOP = "top"
+PFSP = "pfsp"
+
+
+def _numbers(text, sep=None):
+    # Every number of a block of text in one split and one conversion
+    if sep is not None:
+        text = text.replace(sep, " ")
+    return np.array(text.split(), dtype=np.float64)
+
+
+def parse_tsp(path):
+    # "id x y" per line, ids starting at 1
+    with open(path) as instance:
+        data = _numbers(instance.read()).reshape(-1, 3)
+    coords = np.empty((len(data), 2))
+    coords[data[:, 0].astype(np.int64) - 1] = data[:, 1:]
+    return {"coords": coords}
+
+
+def parse_cvrp(path):
+    # "x y demand" per line, depot first
+    with open(path) as instance:
+        data = _numbers(instance.read()).reshape(-1, 3)
+    return {"coords": data[:, :2].copy(), "demands": data[:, 2].copy()}
+
+
+def parse_top(path):
+    # "n;..", "m;<fleet size>" and "tmax;<max route cost>" header lines,
+    # then "x;y;score" per node, start first and finish last
+    with open(path) as instance:
+        lines = instance.read().split("\n", 3)
+    data = _numbers(lines[3], ";").reshape(-1, 3)
+    return {"coords": data[:, :2].copy(), "demands": data[:, 2].copy(),
+            "fleet_size": np.array(int(lines[1].split(";")[1])),
+            "route_max_cost": np.array(float(lines[2].split(";")[1]))}
+
+
+def parse_pfsp(path):
+    # Comment line, "<jobs> <machines>", comment line, then one
+    # tab-separated row of processing times per job
+    with open(path) as instance:
+        lines = instance.read().split("\n", 3)
+    num_jobs, num_machines = (int(x) for x in lines[1].split()[:2])
+    return {"processing_times": _numbers(lines[3]).reshape(num_jobs, num_machines)}
+
+
+PARSERS = {
+    TSP: parse_tsp,
+    CVRP: parse_cvrp,
+    TOP: parse_top,
+    PFSP: parse_pfsp,
+}
+
+
+def instance_kind(path):
+    name = os.path.basename(path)
+    if name.endswith("_input_nodes.txt"):
+        return CVRP
+    if name.endswith("_inputs.txt"):
+        return PFSP
+    with open(path) as instance:
+        first_line = instance.readline()
+    return TOP if ";" in first_line else TSP
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as instance:
+        for block in iter(lambda: instance.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_entry(path, kind, cache_dir=CACHE_DIR):
+    # One directory of .npy files per file contents, so an edited file
+    # gets a new entry
+    return os.path.join(cache_dir, f"{os.path.basename(path)}.{kind}.{file_hash(path)[:16]}")
+
+
+def load_instance(path, kind=None, cache_dir=CACHE_DIR):
+    # Arrays of an instance file by name: coords, demands, fleet_size,
+    # route_max_cost or processing_times depending on the kind. The file
+    # is parsed once, later calls memory-map the cached arrays read-only.
+    # cache_dir=None always parses.
+    if kind is None:
+        kind = instance_kind(path)
+    if cache_dir is None:
+        return PARSERS[kind](path)
+    entry = cache_entry(path, kind, cache_dir)
+    if not os.path.isdir(entry):
+        _write_entry(entry, PARSERS[kind](path))
+    return _read_entry(entry)
+
+
+def load_dist_matrix(path, kind=None, cache_dir=CACHE_DIR, condensed=False, dtype=None):
+    # Euclidean matrix of the instance coordinates, computed once and
+    # memory-mapped afterwards, so processes share one copy in the page
+    # cache. condensed and dtype are those of DistanceMatrix, each storage
+    # is cached in its own file.
+    if kind is None:
+        kind = instance_kind(path)
+    coords = load_instance(path, kind, cache_dir)["coords"]
+    if cache_dir is None:
+        return DistanceMatrix(coords, condensed, dtype)
+    if dtype is None:
+        dtype = np.float32 if condensed else np.float64
+    entry = cache_entry(path, kind, cache_dir)
+    file_name = _matrix_file_name(condensed, dtype)
+    matrix_file = os.path.join(entry, file_name)
+    if not os.path.exists(matrix_file):
+        temporary = f"{entry}.{file_name[:-4]}.{os.getpid()}.npy"
+        np.save(temporary, DistanceMatrix(coords, condensed, dtype).data)
+        os.replace(temporary, matrix_file)
+    return DistanceMatrix.from_array(_load_array(matrix_file), condensed)
+
+
+def _matrix_file_name(condensed, dtype):
+    return f"dist_matrix.{'condensed' if condensed else 'full'}.{np.dtype(dtype).str[1:]}.npy"
+
+
+def _write_entry(entry, arrays):
+    # Written under a temporary name and renamed, so no process ever reads
+    # a partial entry
+    temporary = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(temporary, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + ".npy"), array)
+    try:
+        os.rename(temporary, entry)
+    except OSError:
+        # Another process wrote the same entry first
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def _read_entry(entry):
+    arrays = {}
+    for file_name in os.listdir(entry):
+        if file_name.endswith(".npy") and not file_name.startswith("dist_matrix."):
+            arrays[file_name[:-4]] = _load_array(os.path.join(entry, file_name))
+    return arrays
+
+
+def _load_array(file_name):
+    # Plain ndarray over the mapping, np.memmap indexing is much slower
+    # for the scalar lookups the solvers do
+    return np.load(file_name, mmap_mode="r").view(np.ndarray)
+
+
+if __name__ == "__main__":
+    # Warm the cache: python loader.py [--matrix] [--condensed] files...
+    with_matrix = "--matrix" in sys.argv[1:]
+    condensed = "--condensed" in sys.argv[1:]
+    for path in [arg for arg in sys.argv[1:] if arg not in ("--matrix", "--condensed")]:
+        start = time.time()
+        arrays = load_instance(path)
+        if with_matrix and "coords" in arrays:
+            load_dist_matrix(path, condensed=condensed)
+        end = time.time()
+        print(f"{path}: {', '.join(f'{name} {array.shape}' for name, array in sorted(arrays.items()))}, Time (s): {end-start:.3f}")
@@ -0,0 +1,151 @@
+from collections import deque
+
+import numpy as np
+
+TWO_OPT = "2-opt"
+OR_OPT = "or-opt"
+
+
+def build_reverse_neighbors(neighbors):
+    # For every city, the cities that have it in their candidate list
+    neighbors = np.asarray(neighbors)
+    n, k = neighbors.shape
+    targets = neighbors.ravel()
+    order = np.argsort(targets, kind="stable")
+    owners = np.repeat(np.arange(n), k)[order]
+    bounds = np.cumsum(np.bincount(targets, minlength=n))[:-1]
+    return [owner.tolist() for owner in np.split(owners, bounds)]
+
+
+def local_search(tour, dist_matrix, neighbors, moves=(TWO_OPT,), active=None, max_segment=3, reverse_neighbors=None, stats=None, budget=None):
+    # First-improvement search over candidate lists with don't-look bits.
+    # Only cities in the queue are scanned; a city leaves the queue when no
+    # improving move starts from it. When a move changes the edges of a
+    # city, that city and every city having it as a candidate re-enter the
+    # queue, so the search stops at a true local optimum of the candidate
+    # neighbourhood. The tour is improved in place and returned.
+    # reverse_neighbors can be passed to avoid rebuilding it on every call.
+    # Counts of scanned cities and evaluated and applied moves go to stats,
+    # evaluated moves also to budget.
+    if reverse_neighbors is None:
+        reverse_neighbors = build_reverse_neighbors(neighbors)
+    if hasattr(neighbors, "tolist"):
+        neighbors = neighbors.tolist()
+    if active is None:
+        active = tour.order.tolist()
+    queue = deque(active)
+    in_queue = bytearray(tour.n)
+    for city in queue:
+        in_queue[city] = 1
+
+    scanned = 0
+    evaluated = 0
+    applied = 0
+    while queue:
+        a = queue.popleft()
+        in_queue[a] = 0
+        scanned += 1
+        for move_type in moves:
+            if move_type == TWO_OPT:
+                move, count = _improving_2_opt_move(tour, dist_matrix, neighbors[a], a)
+                evaluated += count
+                if move is None:
+                    continue
+                first, second, delta = move
+                touched = (first, tour.succ(first), second, tour.succ(second))
+                tour.two_opt_move(first, second, delta)
+            elif move_type == OR_OPT:
+                move, count = _improving_or_opt_move(tour, dist_matrix, neighbors[a], a, max_segment)
+                evaluated += count
+                if move is None:
+                    continue
+                first, last, u, v, reverse, delta = move
+                touched = (tour.pred(first), first, last, tour.succ(last), u, v)
+                tour.or_opt_move(first, last, u, v, reverse, delta)
+            else:
+                raise ValueError(f"Unknown move type: {move_type}")
+            for city in touched:
+                if not in_queue[city]:
+                    in_queue[city] = 1
+                    queue.append(city)
+                for other in reverse_neighbors[city]:
+                    if not in_queue[other]:
+                        in_queue[other] = 1
+                        queue.append(other)
+            applied += 1
+            break
+    if stats is not None:
+        stats.add("cities scanned", scanned)
+        stats.add("moves evaluated", evaluated)
+        stats.add("moves applied", applied)
+    if budget is not None:
+        budget.add_evaluations(evaluated)
+    return tour
+
+
+def two_opt(tour, dist_matrix, neighbors, active=None, reverse_neighbors=None, stats=None, budget=None):
+    return local_search(tour, dist_matrix, neighbors, (TWO_OPT,), active, reverse_neighbors=reverse_neighbors, stats=stats, budget=budget)
+
+
+def or_opt(tour, dist_matrix, neighbors, active=None, max_segment=3, reverse_neighbors=None, stats=None, budget=None):
+    return local_search(tour, dist_matrix, neighbors, (OR_OPT,), active, max_segment, reverse_neighbors, stats, budget)
+
+
+def _improving_2_opt_move(tour, dist_matrix, candidates, a):
+    # Returns the move (or None) and the number of moves evaluated
+    evaluated = 0
+    for step in (tour.succ, tour.pred):
+        b = step(a)
+        d_ab = dist_matrix[a, b]
+        for c in candidates:
+            d_ac = dist_matrix[a, c]
+            # Candidates are sorted, no later one can give a gain
+            if d_ac >= d_ab:
+                break
+            d = step(c)
+            if c == b or d == a:
+                continue
+            evaluated += 1
+            delta = d_ac + dist_matrix[b, d] - d_ab - dist_matrix[c, d]
+            if delta < -1e-9:
+                if step == tour.succ:
+                    return (a, c, delta), evaluated
+                # Edges (b, a) and (d, c) seen from the other direction
+                return (b, d, delta), evaluated
+    return None, evaluated
+
+
+def _improving_or_opt_move(tour, dist_matrix, candidates, a, max_segment):
+    # Segments of 1..max_segment cities that start or end at a, reinserted
+    # next to one of a's candidates in either orientation. Returns the move
+    # (or None) and the number of moves evaluated
+    evaluated = 0
+    if tour.n < max_segment + 3:
+        max_segment = tour.n - 3
+    for length in range(1, max_segment + 1):
+        for a_is_first in ((True,) if length == 1 else (True, False)):
+            segment = [a]
+            for _ in range(length - 1):
+                segment.append(tour.succ(segment[-1]) if a_is_first else tour.pred(segment[-1]))
+            first, last = (segment[0], segment[-1]) if a_is_first else (segment[-1], segment[0])
+            p = tour.pred(first)
+            n = tour.succ(last)
+            removal_gain = dist_matrix[p, first] + dist_matrix[last, n] - dist_matrix[p, n]
+            if removal_gain <= 1e-9:
+                continue
+            for c in candidates:
+                # a must be joined to c, which has to pay for itself
+                if dist_matrix[a, c] >= removal_gain:
+                    break
+                if c in segment:
+                    continue
+                # a right after c, or a right before c
+                for u, v, a_after_u in ((c, tour.succ(c), True), (tour.pred(c), c, False)):
+                    if u in segment or v in segment:
+                        continue
+                    reverse = a_is_first != a_after_u
+                    evaluated += 1
+                    delta = tour.or_opt_delta(first, last, u, v, reverse, dist_matrix)
+                    if delta < -1e-9:
+                        return (first, last, u, v, reverse, delta), evaluated
+    return None, evaluated
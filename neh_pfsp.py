@@ -1,6 +1,9 @@
 
-import operator
+import random
 import time
+import numpy as np
+from loader import load_instance, PFSP
+from instrumentation import laps
 
 class Job:
     def __init__(self, id, processing_times, total_processing_time):
@@ -36,135 +39,277 @@ class Solution:
                     max_time = max(times[row-1][column], times[row][column-1])
                     times[row][column] = max_time + self.jobs[row].processing_times[column]
         return times[num_rows-1][num_cols-1]
-    
-def compute_e_matrix(sol, k):
-    num_rows = k
-    num_cols = sol.num_machines
-    e = [[0 for j in range(num_cols)] for i in range(num_rows)]
-    for i in range(k):
-        for j in range(sol.num_machines):
-            if i == 0 and j == 0: e[i][j] = sol.jobs[i].processing_times[j]
-            elif j == 0: e[i][j] = e[i-1][j] + sol.jobs[i].processing_times[j]
-            elif i == 0: e[i][j] = e[i][j-1] + sol.jobs[i].processing_times[j]
-            else:
-                max_time = max(e[i-1][j], e[i][j-1])
-                e[i][j] = max_time + sol.jobs[i].processing_times[j]
-    return e
-
-def compute_q_matrix(sol, k):
-    num_rows = k+1
-    num_cols = sol.num_machines
-    q = [[0 for j in range(num_cols)] for i in range(num_rows)]
-    for i in range(k, -1, -1):
-        for j in range(sol.num_machines-1, -1, -1):
-            if i == k: 
-                q[k][j] = 0
-            elif i == k-1 and j == sol.num_machines-1:
-                q[i][j] = sol.jobs[i].processing_times[j]
-            elif j == sol.num_machines-1:
-                q[i][j] = q[i+1][j] + sol.jobs[i].processing_times[j]
-            elif i == k - 1:
-                q[i][j] = q[i][j+1] + sol.jobs[i].processing_times[j]
-            else:
-                max_time = max(q[i+1][j], q[i][j+1])
-                q[i][j] = max_time + sol.jobs[i].processing_times[j]
-    return q
-
-def compute_f_matrix(sol, k, e):
-    num_rows = k+1
-    num_cols = sol.num_machines
-    f = [[0 for j in range(num_cols)] for i in range(num_rows)]
-    for i in range(k+1):
-        for j in range(sol.num_machines):
-            if i == 0 and j == 0:
-                f[i][j] = sol.jobs[k].processing_times[0]
-            elif j == 0:
-                f[i][j] = e[i-1][j] + sol.jobs[k].processing_times[j]
-            elif i == 0:
-                f[i][j] = f[i][j-1] + sol.jobs[k].processing_times[j]
-            else:
-                max_time = max(e[i-1][j], f[i][j-1])
-                f[i][j] = max_time + sol.jobs[k].processing_times[j]
-    return f
-
-    
-def improve_by_shifting_job_to_left(sol, k):
-    best_position = k
-    min_makespan = float("inf")
-    e_matrix = compute_e_matrix(sol, k)
-    q_matrix = compute_q_matrix(sol, k)
-    f_matrix = compute_f_matrix(sol, k, e_matrix)
-
-    for i in range(k, -1, -1):
-        max_sum = 0.0
-        for j in range(sol.num_machines):
-            new_sum = f_matrix[i][j] + q_matrix[i][j]
-            if new_sum > max_sum: 
-                max_sum = new_sum
-        new_makespan = max_sum
-
-        if new_makespan <= min_makespan:
-            min_makespan = new_makespan
-            best_position = i
-
-    if best_position < k:
-        aux_job = sol.jobs[k]
-        for i in range(k, best_position, -1):
-            sol.jobs[i] = sol.jobs[i-1]
-        sol.jobs[best_position] = aux_job
-
-    if k == sol.num_jobs - 1:
-        sol.makespan = min_makespan
-
-    return sol
-
-        
 
-if __name__ == "__main__":
 
-    instance_name = "tai117_500_20"
-    #instance_name = "tai109_200_20"
-    #instance_name = "tai084_100_20"
-    #instance_name = "tai044_50_10"
+class TaillardInsertion:
+    # Preallocated e/q/f buffers for inserting one job at every position of
+    # a k-job sequence. Each column recurrence x[i] = max(x[i-1], b[i]) + p[i]
+    # is solved at once as D[i] + max_{l<=i}(b[l] - D[l-1]) with D = cumsum(p).
+    # Padding rows/columns of zeros stand for the empty prefix, suffix and
+    # machine 0 so no boundary case needs special handling.
+    def __init__(self, num_jobs, num_machines):
+        self.num_machines = num_machines
+        self.e = np.zeros((num_jobs + 1, num_machines + 1)) # e[i+1][j+1]: heads
+        self.q = np.zeros((num_jobs + 1, num_machines + 1)) # q[i][j]: tails
+        self.f = np.zeros((num_jobs + 1, num_machines + 1)) # f[i][j+1]: inserted job
+        self.sums = np.empty((num_jobs + 1, num_machines))
+        self.makespans = np.empty(num_jobs + 1)
+        self.cumsum = np.empty(num_jobs + 1)
+        self.tmp = np.empty(num_jobs + 1)
+
+    def _scan(self, p, b, out):
+        k = len(p)
+        cumsum = self.cumsum[:k]
+        tmp = self.tmp[:k]
+        np.cumsum(p, out=cumsum)
+        np.subtract(b, cumsum, out=tmp)
+        tmp += p
+        np.maximum.accumulate(tmp, out=tmp)
+        np.add(cumsum, tmp, out=out)
+
+    def evaluate(self, ordered, k, job_times):
+        # Makespans of inserting job_times at positions 0..k of ordered[:k]
+        m = self.num_machines
+        e, q, f = self.e, self.q, self.f
+        for j in range(m):
+            self._scan(ordered[:k, j], e[1:k+1, j], e[1:k+1, j+1])
+        q[k, :] = 0
+        for j in range(m - 1, -1, -1):
+            self._scan(ordered[:k, j][::-1], q[:k, j+1][::-1], q[:k, j][::-1])
+        for j in range(m):
+            np.maximum(e[:k+1, j+1], f[:k+1, j], out=f[:k+1, j+1])
+            f[:k+1, j+1] += job_times[j]
+        sums = self.sums[:k+1]
+        np.add(f[:k+1, 1:], q[:k+1, :m], out=sums)
+        return np.max(sums, axis=1, out=self.makespans[:k+1])
+
+
+def neh_sequence(processing_times):
+    # NEH on a jobs x machines array, returns the job order and its makespan
+    processing_times = np.asarray(processing_times, dtype=np.float64)
+    num_jobs, num_machines = processing_times.shape
+    order = np.argsort(-processing_times.sum(axis=1), kind="stable")
+    insertion = TaillardInsertion(num_jobs, num_machines)
+    sequence = np.empty(num_jobs, dtype=np.int64)
+    ordered = np.empty((num_jobs, num_machines))
+    sequence[0] = order[0]
+    ordered[0] = processing_times[order[0]]
+    makespan = float(np.sum(ordered[0]))
+
+    for k in range(1, num_jobs):
+        job = order[k]
+        makespans = insertion.evaluate(ordered, k, processing_times[job])
+        # Lowest position on ties
+        position = int(np.argmin(makespans))
+        makespan = float(makespans[position])
+        sequence[position+1:k+1] = sequence[position:k]
+        ordered[position+1:k+1] = ordered[position:k]
+        sequence[position] = job
+        ordered[position] = processing_times[job]
+
+    return sequence, makespan
+
+
+def compute_makespans(processing_times, permutations, max_chunk_elements=2**22):
+    # Makespan of every row of a (batch x jobs) permutation array. Rows are
+    # processed in chunks so the working set stays at chunk x machines, and
+    # each job is one vectorized scan over the machines of the whole chunk.
+    processing_times = np.asarray(processing_times, dtype=np.float64)
+    permutations = np.atleast_2d(np.asarray(permutations, dtype=np.int64))
+    batch_size, num_jobs = permutations.shape
+    num_machines = processing_times.shape[1]
+    chunk_size = max(1, max_chunk_elements // num_machines)
+    makespans = np.empty(batch_size)
+
+    for start in range(0, batch_size, chunk_size):
+        chunk = permutations[start:start+chunk_size]
+        shape = (len(chunk), num_machines)
+        completion = np.zeros(shape)
+        times = np.empty(shape)
+        cumsum = np.empty(shape)
+        tmp = np.empty(shape)
+        for i in range(num_jobs):
+            np.take(processing_times, chunk[:, i], axis=0, out=times)
+            np.cumsum(times, axis=1, out=cumsum)
+            np.subtract(completion, cumsum, out=tmp)
+            tmp += times
+            np.maximum.accumulate(tmp, axis=1, out=tmp)
+            np.add(cumsum, tmp, out=completion)
+        makespans[start:start+len(chunk)] = completion[:, -1]
+
+    return makespans
+
+
+def _remove_job(sequence, ordered, k, position):
+    # Drop the job at position from a k-job sequence
+    job = sequence[position]
+    sequence[position:k-1] = sequence[position+1:k]
+    ordered[position:k-1] = ordered[position+1:k]
+    return job
+
+
+def _insert_job(sequence, ordered, k, position, job, job_times):
+    # Insert job at position of a k-job sequence
+    sequence[position+1:k+1] = sequence[position:k]
+    ordered[position+1:k+1] = ordered[position:k]
+    sequence[position] = job
+    ordered[position] = job_times
+
+
+def insertion_local_search(processing_times, sequence, ordered, makespan, insertion, rng):
+    # Take every job out in random order and put it back at its best
+    # position; repeat while a full pass improves the makespan
+    num_jobs = len(sequence)
+    improved = True
+    while improved:
+        improved = False
+        for job in rng.permutation(num_jobs):
+            position = int(np.flatnonzero(sequence == job)[0])
+            _remove_job(sequence, ordered, num_jobs, position)
+            makespans = insertion.evaluate(ordered, num_jobs-1, processing_times[job])
+            best_position = int(np.argmin(makespans))
+            if makespans[best_position] < makespan:
+                makespan = float(makespans[best_position])
+                position = best_position
+                improved = True
+            _insert_job(sequence, ordered, num_jobs-1, position, job, processing_times[job])
+    return makespan
+
+
+def iterated_greedy(processing_times, time_limit, destruction_size=4, temperature_factor=0.4, seed=None):
+    # Iterated greedy (Ruiz & Stutzle) starting from NEH: remove
+    # destruction_size random jobs, reinsert them greedily, run the
+    # insertion local search and accept with a constant-temperature
+    # Metropolis rule. Every insertion goes through TaillardInsertion.
+    # Returns the best sequence, its makespan and the (seconds, makespan)
+    # history of improvements.
+    if destruction_size < 1:
+        raise ValueError(f"destruction_size must be at least 1, got {destruction_size}")
+    start = time.time()
+    # Without a seed the run follows random.seed
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+    processing_times = np.asarray(processing_times, dtype=np.float64)
+    num_jobs, num_machines = processing_times.shape
+    if num_jobs < 2:
+        # A single job has nothing to destroy or reorder
+        sequence, makespan = neh_sequence(processing_times)
+        return sequence, makespan, [(time.time() - start, makespan)]
+    temperature = temperature_factor * processing_times.sum() / (num_jobs * num_machines * 10)
+    insertion = TaillardInsertion(num_jobs, num_machines)
+
+    sequence, makespan = neh_sequence(processing_times)
+    ordered = processing_times[sequence]
+    makespan = insertion_local_search(processing_times, sequence, ordered, makespan, insertion, rng)
+    best_sequence, best_makespan = sequence.copy(), makespan
+    history = [(time.time() - start, best_makespan)]
+
+    while time.time() - start < time_limit:
+        new_sequence = sequence.copy()
+        new_ordered = ordered.copy()
+
+        # Destruction
+        k = num_jobs
+        removed = []
+        for _ in range(min(destruction_size, num_jobs - 1)):
+            removed.append(_remove_job(new_sequence, new_ordered, k, int(rng.integers(k))))
+            k -= 1
+
+        # Reconstruction
+        for job in removed:
+            makespans = insertion.evaluate(new_ordered, k, processing_times[job])
+            position = int(np.argmin(makespans))
+            new_makespan = float(makespans[position])
+            _insert_job(new_sequence, new_ordered, k, position, job, processing_times[job])
+            k += 1
 
+        new_makespan = insertion_local_search(processing_times, new_sequence, new_ordered, new_makespan, insertion, rng)
+
+        if new_makespan < makespan or rng.random() <= np.exp(-(new_makespan - makespan) / temperature):
+            sequence, ordered, makespan = new_sequence, new_ordered, new_makespan
+            if makespan < best_makespan:
+                best_sequence, best_makespan = sequence.copy(), makespan
+                history.append((time.time() - start, best_makespan))
+
+    return best_sequence, best_makespan, history
+
+
+def load_pfsp_instance(instance_name):
     file_name = "pfsp_data/"+instance_name+"_inputs.txt"
 
-    with open(file_name) as instance:
-        i = -3
-        jobs = []
-        for line in instance:
-            if i == -3: pass
-            elif i == -2:
-                num_jobs = int(line.split()[0])
-                num_machines = int(line.split()[1])
-            elif i == -1: pass
-            else:
-                data = [float(x) for x in line.split("\t")]
-                total_processing_time = sum(data)
-                job = Job(i, data, total_processing_time)
-                jobs.append(job)
-            i += 1
+    processing_times = load_instance(file_name, PFSP)["processing_times"]
+    num_jobs, num_machines = processing_times.shape
+    jobs = [Job(i, data, sum(data)) for i, data in enumerate(processing_times.tolist())]
+
+    return jobs, num_jobs, num_machines
+
+
+def neh_pfsp_algorithm(instance_name, stats=None):
+    lap = laps(stats)
+    jobs, num_jobs, num_machines = load_pfsp_instance(instance_name)
+    lap("load")
 
     t_start = time.time()
 
-    jobs.sort(key = operator.attrgetter('total_processing_time'), reverse=True)
+    processing_times = np.array([job.processing_times for job in jobs])
+    sequence, makespan = neh_sequence(processing_times)
+    lap("neh")
     sol = Solution(num_jobs, num_machines)
-    index = 0 # Greedy
-    sol.jobs.append(jobs[index])
+    sol.jobs = [jobs[index] for index in sequence]
+    sol.makespan = makespan
+
+    t_end = time.time()
+
+    return sol, num_jobs, num_machines, t_end-t_start
+
+
+def ig_pfsp_algorithm(instance_name, time_limit=60.0, destruction_size=4, temperature_factor=0.4, seed=None, stats=None):
+    lap = laps(stats)
+    jobs, num_jobs, num_machines = load_pfsp_instance(instance_name)
+    lap("load")
+
+    t_start = time.time()
 
-    for i in range(1, num_jobs):
-        index = i
-        sol.jobs.append(jobs[index])
-        sol = improve_by_shifting_job_to_left(sol, i)
+    processing_times = np.array([job.processing_times for job in jobs])
+    sequence, makespan, history = iterated_greedy(processing_times, time_limit, destruction_size, temperature_factor, seed)
+    lap("iterated greedy")
+    if stats is not None:
+        stats.add("improvements", len(history))
+    sol = Solution(num_jobs, num_machines)
+    sol.jobs = [jobs[index] for index in sequence]
+    sol.makespan = makespan
 
     t_end = time.time()
 
+    return sol, history, t_end-t_start
+
+
+if __name__ == "__main__":
+
+    instance_name = "tai117_500_20"
+    #instance_name = "tai109_200_20"
+    #instance_name = "tai084_100_20"
+    #instance_name = "tai044_50_10"
+
+    ig_time_limit = 60.0
+
+    sol, num_jobs, num_machines, time_taken = neh_pfsp_algorithm(instance_name)
+
     print("Instance: "+instance_name+" with "+str(num_jobs)+" jobs and "+str(num_machines)+" machines")
     print("NEH makespan with Taillard acceleration =", "{:.{}f}".format(sol.makespan, 2))
     print("NEH verification with traditional method:", "{:.{}f}".format(sol.compute_makespan(), 2))
-    print("Computational time:", "{:.{}f}".format(t_end-t_start, 1), "sec.")
+    print("Computational time:", "{:.{}f}".format(time_taken, 1), "sec.")
     permutation = "( "
-    for job in jobs:
+    for job in sol.jobs:
         permutation = permutation + str(job.id) + " "
     permutation = permutation + ")"
     print("Sol:", permutation)
+
+    sol, history, time_taken = ig_pfsp_algorithm(instance_name, ig_time_limit)
+
+    print("-------------------------------------")
+    print("Iterated Greedy makespan =", "{:.{}f}".format(sol.makespan, 2))
+    print("IG verification with traditional method:", "{:.{}f}".format(sol.compute_makespan(), 2))
+    print("Computational time:", "{:.{}f}".format(time_taken, 1), "sec.")
+    print("Time (s),Makespan")
+    for elapsed, makespan in history:
+        print(f"{elapsed:.2f},{makespan:.2f}")
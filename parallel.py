@@ -0,0 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def split_work(total, workers, seed):
+    # (share, seed sequence) per worker: total is split evenly, the first
+    # total % workers workers doing one more, and worker w draws from the
+    # w-th stream spawned from seed, so results only depend on seed and
+    # workers. Workers left without work are dropped, so no more than total
+    # iterations are ever run. total=None gives every worker no limit.
+    if total is not None and total < 1:
+        raise ValueError(f"total must be at least 1, got {total}")
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    if total is None:
+        return [(None, worker_seed) for worker_seed in seeds]
+    shares = [total // workers + (1 if worker < total % workers else 0) for worker in range(workers)]
+    return [(share, worker_seed) for share, worker_seed in zip(shares, seeds) if share > 0]
+
+
+def map_workers(function, jobs, initializer=None, initargs=()):
+    # One process per job
+    with ProcessPoolExecutor(max_workers=len(jobs), initializer=initializer, initargs=initargs) as executor:
+        return list(executor.map(function, jobs))
+
+
+def best_result(results):
+    # Result with the lowest cost, the first item of each. Ties go to the
+    # lowest worker so the reduction is deterministic.
+    return min(results, key=lambda result: result[0])
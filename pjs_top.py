@@ -1,9 +1,12 @@
-import math
 import time
+from collections import deque
 import operator
-import networkx as nx
-import matplotlib.pyplot as plt
 import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from distance import build_dist_matrix
+from loader import load_instance, load_dist_matrix, TOP
+from instrumentation import laps, counted
 
 class Node:
     def __init__(self, id, x, y, demand):
@@ -22,9 +25,47 @@ class Node:
     
 
 class Route:
-    def __init__(self):
-        self.edges = []
-        self.demand = 0.0
+    # Path of customers between two depot endpoints. Each end is attached to
+    # the start or the finish node; cost and demand (reward) are kept up to
+    # date on every extension and merge.
+    def __init__(self, first_depot, nodes, last_depot, cost, demand):
+        self.first_depot = first_depot
+        self.nodes = deque(nodes)
+        self.last_depot = last_depot
+        self.cost = cost
+        self.demand = demand
+
+    @property
+    def start_node(self):
+        return self.nodes[0]
+
+    @property
+    def end_node(self):
+        return self.nodes[-1]
+
+    def depot_of(self, node):
+        # Depot attached to an end node
+        return self.first_depot if node is self.nodes[0] else self.last_depot
+
+    def nodes_from(self, node):
+        # Customers walked from the end node to the other end, and the depot there
+        if node is self.nodes[0]:
+            return self.nodes, self.last_depot
+        return reversed(self.nodes), self.first_depot
+
+    def extend(self, node, new_nodes, depot):
+        # Attach new_nodes beyond the end node, the last one to depot
+        if node is self.nodes[-1]:
+            self.nodes.extend(new_nodes)
+            self.last_depot = depot
+        else:
+            self.nodes.extendleft(new_nodes)
+            self.first_depot = depot
+
+    @property
+    def edges(self):
+        nodes = list(self.nodes)
+        return [(self.first_depot, nodes[0])] + list(zip(nodes, nodes[1:])) + [(nodes[-1], self.last_depot)]
 
     def __str__(self) -> str:
         return f"{self.edges} -> Demand: {self.demand:.2f}" 
@@ -33,172 +74,259 @@ class Route:
         return str(self.edges)
 
 
-def dist(node_1: Node, node_2: Node):
-    return math.sqrt((node_1.x - node_2.x)**2 + (node_1.y - node_2.y)**2)
+class TopInstance:
+    def __init__(self, fileName, nodes, fleetSize, routeMaxCost, dist_matrix=None):
+        self.name = fileName.split("/")[-1][:-4]
+        self.nodes = nodes
+        self.fleetSize = fleetSize
+        self.routeMaxCost = routeMaxCost
+
+        # Compute Distance Matrix
+        self.dist_matrix = build_dist_matrix(nodes) if dist_matrix is None else dist_matrix
+
+        # Savings and rewards of every candidate pair, combined per alpha
+        num_nodes = len(nodes)
+        start = nodes[0]
+        finish = nodes[-1]
+        self.pair_i, self.pair_j = np.triu_indices(num_nodes - 2, k=1)
+        self.pair_i += 1
+        self.pair_j += 1
+        distances = self.dist_matrix
+        self.pair_savings = distances[np.full(len(self.pair_i), start.id), self.pair_i] + distances[np.full(len(self.pair_j), finish.id), self.pair_j] - distances[self.pair_i, self.pair_j]
+        demands = np.array([node.demand for node in nodes])
+        self.pair_rewards = demands[self.pair_i] + demands[self.pair_j]
 
 
-def compute_efficiency(node_i:Node, node_j:Node, start:Node, finish:Node, alpha, dist_matrix):
-    savings = dist_matrix[start.id][node_i.id] + dist_matrix[finish.id][node_j.id] - dist_matrix[node_i.id][node_j.id]
-    reward = node_i.demand + node_j.demand
-    return alpha * savings + (1-alpha) * reward
+def load_top_instance(fileName, condensed=False):
 
+    # Load file, arrays and matrix come from the cache after the first run.
+    # condensed keeps only the upper triangle of the matrix in float32.
+    arrays = load_instance(fileName, TOP)
+    nodes = [Node(i, x, y, demand) for i, ((x, y), demand) in enumerate(zip(arrays["coords"].tolist(), arrays["demands"].tolist()))]
+    fleetSize = int(arrays["fleet_size"])
+    routeMaxCost = float(arrays["route_max_cost"])
 
-def compute_route_cost(route:Route, dist_matrix):
-    cost = 0
-    for nodes in route.edges:
-        cost += dist_matrix[nodes[0].id][nodes[1].id]
-    return cost
+    return TopInstance(fileName, nodes, fleetSize, routeMaxCost, load_dist_matrix(fileName, TOP, condensed=condensed))
 
-def pjs_top_algorithm(fileName, alpha, plot_graph=False, print_sols = False):
+
+def pjs_top_algorithm(fileName, alpha, plot_graph=False, print_sols = False, plotter=None, stats=None, condensed=False):
 
     start_time = time.time()
+    lap = laps(stats)
+
+    instance = load_top_instance(fileName, condensed)
+    lap("load")
 
-    # Load file
-    with open(fileName) as instance:
-        i = -3
-        nodes = []
-        for line in instance:
-            if i == -3: pass
-            elif i == -2: fleetSize = int( line.split(";")[1] )
-            elif i == -1: routeMaxCost = float( line.split(";")[1] )
-            else:
-                data = [float(x) for x in line.split(";")]
-                aNode = Node(i, data[0], data[1], data[2])
-                nodes.append(aNode)
-            i += 1
+    load_time = time.time() - start_time
 
+    # The solver time excludes any plotting
+    result = pjs_top_solve(instance, alpha, plot_graph, print_sols, plotter, stats)
+
+    return result[:-1] + (load_time + result[-1],)
+
+
+def add_node(node, new_node, start, finish, routeMaxCost, dist_matrix):
+    # Attach new_node next to the end node of its route if the route length
+    # allows it. As before, the finish-side test is made first and the
+    # start-side one only when node is attached to the start.
+    route = node.route
+    new_cost = route.cost - dist_matrix[node.id, finish.id] + dist_matrix[node.id, new_node.id] + dist_matrix[new_node.id, finish.id]
+    if new_cost > routeMaxCost:
+        return
+    depot = route.depot_of(node)
+    if depot is not finish:
+        new_cost = route.cost - dist_matrix[start.id, node.id] + dist_matrix[new_node.id, node.id] + dist_matrix[start.id, new_node.id]
+        if new_cost > routeMaxCost:
+            return
+    route.extend(node, [new_node], depot)
+    route.cost = new_cost
+    route.demand += new_node.demand
+    node.is_interior = True
+    new_node.route = route
+
+
+def pjs_top_solve(instance, alpha, plot_graph=False, print_sols = False, plotter=None, stats=None):
+
+    start_time = time.time()
+    lap = laps(stats)
+
+    nodes = instance.nodes
+    fleetSize = instance.fleetSize
+    routeMaxCost = instance.routeMaxCost
+    dist_matrix = instance.dist_matrix
     num_nodes = len(nodes)
 
-    # Compute Distance Matrix
-    dist_matrix = [[0]*len(nodes) for _ in range(len(nodes))]
-    for i, node_1 in enumerate(nodes):
-        for j, node_2 in enumerate(nodes):
-            if i<j:
-                dist_matrix[i][j] = dist(node_1, node_2)
-                dist_matrix[j][i] = dist_matrix[i][j]
+    for node in nodes:
+        node.route = None
+        node.is_interior = False
 
     start = nodes[0]
     finish = nodes[-1]
 
-    # Compute Savings List
-    savings = []
-    for node_i in nodes[1:-2]:
-        for node_j in nodes[node_i.id+1:-1]:
-            savings.append((node_i, node_j, compute_efficiency(node_i, node_j, start, finish, alpha, dist_matrix)))
+    # Compute Savings List (ties keep the (i, j) order)
+    efficiency = alpha * instance.pair_savings + (1-alpha) * instance.pair_rewards
+    order = np.argsort(-efficiency, kind='stable')
+    savings = counted(zip(instance.pair_i[order].tolist(), instance.pair_j[order].tolist()), stats, "savings consumed")
+    lap("savings")
 
-    savings.sort(key = lambda x: x[2], reverse=True)
+    # Insertion-ordered dict used as a list with O(1) removal
+    routes = {}
 
-    routes = []
-
-    while len(savings) > 0:
-        node_i, node_j, _ = savings.pop(0)
+    for i, j in savings:
+        node_i = nodes[i]
+        node_j = nodes[j]
         if node_i.route == None and node_j.route == None:
             # Create new route
-            if dist_matrix[start.id][node_i.id] + dist_matrix[node_i.id][node_j.id] + dist_matrix[node_j.id][finish.id] <= routeMaxCost:
-                route = Route()
-                route.edges = [(start, node_i),(node_i, node_j),(node_j, finish)]
+            route_cost = dist_matrix[start.id, node_i.id] + dist_matrix[node_i.id, node_j.id] + dist_matrix[node_j.id, finish.id]
+            if route_cost <= routeMaxCost:
+                route = Route(start, [node_i, node_j], finish, route_cost, node_i.demand + node_j.demand)
                 node_i.route = route
                 node_j.route = route
-                route.demand = node_i.demand + node_j.demand
-                routes.append(route)
+                routes[route] = True
         if node_i.route != None and node_i.is_interior == False and node_j.route == None:
             # Add node_j to node_i route
-            add_to_route = False
-            try:
-                if compute_route_cost(node_i.route, dist_matrix) - dist_matrix[node_i.id][finish.id] + dist_matrix[node_i.id][node_j.id] + dist_matrix[node_j.id][finish.id] <= routeMaxCost:
-                    node_i.route.edges.remove((node_i, finish))
-                    node_i.route.edges.append((node_i, node_j))
-                    node_i.route.edges.append((node_j, finish))
-                    add_to_route = True
-            except:
-                if compute_route_cost(node_i.route, dist_matrix) - dist_matrix[start.id][node_i.id] + dist_matrix[node_j.id][node_i.id] + dist_matrix[start.id][node_j.id] <= routeMaxCost:
-                    node_i.route.edges.remove((start, node_i))
-                    node_i.route.edges.append((node_j, node_i))
-                    node_i.route.edges.append((start, node_j))
-                    add_to_route = True
-            if add_to_route:
-                node_i.is_interior = True
-                node_i.route.demand += node_j.demand
-                node_j.route = node_i.route
+            add_node(node_i, node_j, start, finish, routeMaxCost, dist_matrix)
         if node_j.route != None and node_j.is_interior == False and node_i.route == None:
             # Add node_i to node_j route
-            add_to_route = False
-            try:
-                if compute_route_cost(node_j.route, dist_matrix) - dist_matrix[node_j.id][finish.id] + dist_matrix[node_j.id][node_i.id] + dist_matrix[node_i.id][finish.id] <= routeMaxCost:
-                    node_j.route.edges.remove((node_j, finish))
-                    node_j.route.edges.append((node_j, node_i))
-                    node_j.route.edges.append((node_i, finish))
-                    add_to_route = True
-            except:
-                if compute_route_cost(node_j.route, dist_matrix) - dist_matrix[start.id][node_j.id] + dist_matrix[node_i.id][node_j.id] + dist_matrix[start.id][node_i.id] <= routeMaxCost:
-                    node_j.route.edges.remove((start, node_j))
-                    node_j.route.edges.append((node_i, node_j))
-                    node_j.route.edges.append((start, node_i))
-                    add_to_route = True
-            if add_to_route:
-                node_j.is_interior = True
-                node_j.route.demand += node_i.demand
-                node_i.route = node_j.route
+            add_node(node_j, node_i, start, finish, routeMaxCost, dist_matrix)
         if node_i.route != None and node_i.is_interior == False and node_j.route != None and node_j.is_interior == False and node_i.route != node_j.route:
             # Merge node_i and node_j routes
-            if compute_route_cost(node_i.route, dist_matrix) + compute_route_cost(node_j.route, dist_matrix) <= routeMaxCost:
-                new_route = Route()
-                new_route.edges = node_i.route.edges + node_j.route.edges
-                try:
-                    new_route.edges.remove((node_i, finish))
-                except:
-                    new_route.edges.remove((start, node_i))
-                try:
-                    new_route.edges.remove((node_j, finish))
-                except:
-                    new_route.edges.remove((start, node_j))
-                
-                new_route.edges.append((node_i, node_j))
-                new_route.demand = node_i.route.demand + node_j.route.demand
+            route_i = node_i.route
+            route_j = node_j.route
+            if route_i.cost + route_j.cost <= routeMaxCost:
+                new_cost = route_i.cost + route_j.cost - dist_matrix[node_i.id, route_i.depot_of(node_i).id] - dist_matrix[node_j.id, route_j.depot_of(node_j).id] + dist_matrix[node_i.id, node_j.id]
                 # Merge routes
-                if compute_route_cost(new_route, dist_matrix) <= routeMaxCost:
-                    routes.remove(node_i.route)
-                    routes.remove(node_j.route)
-                    routes.append(new_route)
+                if new_cost <= routeMaxCost:
+                    # The shorter route is moved into the longer one
+                    if len(route_i.nodes) < len(route_j.nodes):
+                        route_i, route_j = route_j, route_i
+                        node_i, node_j = node_j, node_i
+                    moved_nodes, far_depot = route_j.nodes_from(node_j)
+                    moved_nodes = list(moved_nodes)
+                    route_i.extend(node_i, moved_nodes, far_depot)
+                    route_i.cost = new_cost
+                    route_i.demand += route_j.demand
+                    for node in moved_nodes:
+                        node.route = route_i
+                    del routes[route_j]
+                    # Merged route goes to the back, as a new one would
+                    del routes[route_i]
+                    routes[route_i] = True
                     node_i.is_interior = True
                     node_j.is_interior = True
-                    for nodes in node_i.route.edges:
-                        if nodes[0] != start:
-                            nodes[0].route = new_route
-                    for nodes in node_j.route.edges:
-                        if nodes[0] != start:
-                            nodes[0].route = new_route
 
+    lap("merge")
 
+    routes = list(routes)
     routes.sort(key = operator.attrgetter("demand"), reverse=True)
     total_cost = 0
     max_route_cost = 0
     total_route_cost = 0
     for route in routes[:fleetSize]:
         total_cost += route.demand
-        route_cost = compute_route_cost(route, dist_matrix)
+        route_cost = route.cost
         total_route_cost += route_cost
         if route_cost > max_route_cost:
             max_route_cost = route_cost
         if print_sols:
-            print(f"{route}, Cost: {compute_route_cost(route, dist_matrix):.2f}")
+            print(f"{route}, Cost: {route.cost:.2f}")
 
     end_time = time.time()
 
     if plot_graph:
-        G = nx.Graph()
-        G.add_node(start.id, coord=(start.x, start.y))
-        for route in routes[:fleetSize]:
-            for edge in route.edges:
-                G.add_edge(edge[0].id, edge[1].id)
-                G.add_node(edge[1].id, coord = (edge[1].x, edge[1].y))
-        coord = nx.get_node_attributes(G, "coord")
-        nx.draw_networkx(G, coord, node_color="pink")
-        plt.savefig(plot_graph, dpi=300, bbox_inches='tight')
+        # Drawn outside the timed section, in the background when a plotter is given
+        plot_job = (plot_graph, route_plot_data(start, routes[:fleetSize]))
+        if plotter is None:
+            render_routes(*plot_job)
+        else:
+            plotter.submit(*plot_job)
     return total_cost, num_nodes, fleetSize, routeMaxCost, max_route_cost, total_route_cost, end_time-start_time
 
+def route_plot_data(depot, routes):
+    # Plain coordinates only, so the job can be sent to another process
+    return (depot.id, (depot.x, depot.y)), [[(edge[0].id, edge[1].id, (edge[1].x, edge[1].y)) for edge in route.edges] for route in routes]
+
+
+def render_routes(path, plot_data):
+    # networkx and matplotlib are only imported when something is drawn
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
+    (depot_id, depot_coord), routes = plot_data
+    G = nx.Graph()
+    G.add_node(depot_id, coord=depot_coord)
+    for route in routes:
+        for id_a, id_b, coord_b in route:
+            G.add_edge(id_a, id_b)
+            G.add_node(id_b, coord=coord_b)
+    coord = nx.get_node_attributes(G, "coord")
+    plt.figure()
+    nx.draw_networkx(G, coord, node_color="pink")
+    plt.savefig(path, dpi=300, bbox_inches='tight')
+    plt.close()
+    return path
+
+
+class RoutePlotter:
+    # Background queue of plots, drawn one after another by a separate
+    # process while the solver keeps running
+    def __init__(self, workers=1):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def submit(self, path, plot_data):
+        future = self.executor.submit(render_routes, path, plot_data)
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        # Wait for every queued plot and return the written paths
+        paths = [future.result() for future in self.futures]
+        self.executor.shutdown()
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_sweep_instance = None
+
+
+def _init_sweep_worker(instance):
+    global _sweep_instance
+    _sweep_instance = instance
+
+
+def _sweep_worker(alpha):
+    return pjs_top_solve(_sweep_instance, alpha)
+
+
+def pjs_top_alpha_sweep(fileName, alpha_values, workers=None, condensed=False):
+    # Parse the instance and build its matrix and savings once, then solve
+    # every alpha in a pool whose workers each receive the instance once.
+    # The load time is added to every result, so the times compare with
+    # those of pjs_top_algorithm.
+    start_time = time.time()
+    instance = load_top_instance(fileName, condensed)
+    load_time = time.time() - start_time
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker, initargs=(instance,)) as executor:
+        results = list(executor.map(_sweep_worker, alpha_values))
+    return instance, [result[:-1] + (load_time + result[-1],) for result in results]
+
+
+def format_pjs_top_row(instance_name, alpha, result):
+    total_cost, num_nodes, fleetSize, routeMaxCost, max_route_cost, total_route_cost, time_taken = result
+    return f"{instance_name},{alpha},{num_nodes},{fleetSize},{routeMaxCost:.2f},{max_route_cost:.2f},{total_route_cost:.2f},{total_cost:.2f},{time_taken:.3f}"
+
+
 if __name__ == "__main__":
     alpha_values = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1]
+    workers = None
 
     fileNames = [f for f in glob.glob('data/p*.txt')]
     fileNames = ["data/p4.4.l.txt", "data/p3.3.l.txt", "data/p5.4.q.txt"]
@@ -211,6 +339,6 @@ if __name__ == "__main__":
     # "pjs_top_"+instance.replace(".","_")
     print("Instance,alpha,# nodes,fleetSize,routeMaxCost,maxRouteCostFound,totalRouteCostFound, PJS Sol.,Time (s)")
     for fileName in fileNames:
-        for alpha in alpha_values:
-            total_cost, num_nodes, fleetSize, routeMaxCost, max_route_cost, total_route_cost, time_taken = pjs_top_algorithm(fileName, alpha, False, False)
-            print(f"{fileName[5:-4]},{alpha},{num_nodes},{fleetSize},{routeMaxCost:.2f},{max_route_cost:.2f},{total_route_cost:.2f},{total_cost:.2f},{time_taken:.3f}")
+        instance, results = pjs_top_alpha_sweep(fileName, alpha_values, workers)
+        for alpha, result in zip(alpha_values, results):
+            print(format_pjs_top_row(instance.name, alpha, result))
@@ -1,5 +1,8 @@
 import time
 import random
+import numpy as np
+from budget import Budget, MAX_ITERATIONS
+from parallel import split_work, map_workers, best_result
 
 def basin_function_1(x):
     a = 0.5
@@ -12,20 +15,109 @@ def basin_function_2(x):
     return sum([x_i**2 for x_i in x])
 
 
-def random_search(basin_function, searchSpace, problemSize, maxIterations = 100000):
+# Vectorized versions, one cost per row of a (samples, problemSize) array
+def basin_function_1_batch(X):
+    a = 0.5
+    h = 2
+    k = -5
+    return np.sum(a*((X-h)**2)+k, axis=1)
+
+
+def basin_function_2_batch(X):
+    return np.einsum("ij,ij->i", X, X)
+
+
+BATCH_FUNCTIONS = {
+    basin_function_1: basin_function_1_batch,
+    basin_function_2: basin_function_2_batch,
+}
+
+
+def random_search(basin_function, searchSpace, problemSize, maxIterations = 100000, budget=None):
+    # Every sample is one iteration and one evaluation. The search also stops
+    # when budget is exhausted, budget.stop_reason says why it stopped. The
+    # budget is settled once per block of samples, cut to its evaluation
+    # and stagnation limits, so the time limit is checked between blocks.
+    # maxIterations=None leaves only the budget.
+    budget = (Budget() if budget is None else budget).start()
+    bestCost = float("inf")
+    bestSol = [0, 0]
+    num_iters = 0
+    while (maxIterations is None or num_iters < maxIterations) and not budget.exhausted():
+        size = budget.allowed(_block_size(1024, maxIterations, num_iters))
+        num_iters += size
+        improved_at = None
+        for j in range(size):
+            x = [random.uniform(searchSpace[0], searchSpace[1]) for i in range(problemSize)]
+            cost = basin_function(x)
+            if cost < bestCost:
+                bestCost = cost
+                bestSol = x
+                improved_at = j
+        budget.add_evaluations(size)
+        budget.end_iterations(size, improved_at)
+    budget.finish(MAX_ITERATIONS)
+    return bestCost, bestSol
+
+
+def random_search_batch(basin_function, searchSpace, problemSize, maxIterations = 100000, max_block_elements=2**20, seed=None, budget=None):
+    # Same search, but candidates are drawn and scored in blocks of at most
+    # max_block_elements coordinates. basin_function may be one of the
+    # scalar functions above or a function taking a 2-D array. Blocks are
+    # cut to the evaluation and stagnation limits of budget, the time limit
+    # is checked between blocks. maxIterations=None leaves only the budget.
+    budget = (Budget() if budget is None else budget).start()
+    batch_function = BATCH_FUNCTIONS.get(basin_function, basin_function)
+    # Without a seed the stream follows random.seed, like random_search
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
+    block_size = max(1, max_block_elements // problemSize)
     bestCost = float("inf")
     bestSol = [0, 0]
     num_iters = 0
-    while num_iters < maxIterations:
-        num_iters += 1
-        x = [random.uniform(searchSpace[0], searchSpace[1]) for i in range(problemSize)]
-        cost = basin_function(x)
-        if cost < bestCost:
-            bestCost = cost
-            bestSol = x
+    while (maxIterations is None or num_iters < maxIterations) and not budget.exhausted():
+        size = budget.allowed(_block_size(block_size, maxIterations, num_iters))
+        num_iters += size
+        X = rng.uniform(searchSpace[0], searchSpace[1], size=(size, problemSize))
+        costs = batch_function(X)
+        best = int(np.argmin(costs))
+        budget.add_evaluations(size)
+        if costs[best] < bestCost:
+            bestCost = float(costs[best])
+            bestSol = X[best].tolist()
+            budget.end_iterations(size, best)
+        else:
+            budget.end_iterations(size)
+    budget.finish(MAX_ITERATIONS)
     return bestCost, bestSol
 
 
+def _block_size(block_size, maxIterations, num_iters):
+    if maxIterations is None:
+        return block_size
+    return min(block_size, maxIterations - num_iters)
+
+
+def _parallel_random_search_worker(args):
+    basin_function, searchSpace, problemSize, iterations, max_block_elements, seed = args
+    start = time.time()
+    cost, sol = random_search_batch(basin_function, searchSpace, problemSize, iterations, max_block_elements, seed)
+    return cost, sol, iterations, time.time() - start
+
+
+def parallel_random_search(basin_function, searchSpace, problemSize, maxIterations = 100000, workers=4, seed=0, max_block_elements=2**20):
+    # maxIterations is split evenly over the workers, each sampling from its
+    # own stream spawned from seed, so the result only depends on seed and
+    # workers. basin_function must be picklable (a module-level function).
+    jobs = [(basin_function, searchSpace, problemSize, iterations, max_block_elements, worker_seed)
+            for iterations, worker_seed in split_work(maxIterations, workers, seed)]
+    results = map_workers(_parallel_random_search_worker, jobs)
+
+    bestCost, bestSol, _, _ = best_result(results)
+    stats = [{"worker": worker, "iterations": iterations, "best_cost": cost, "time": time_taken}
+             for worker, (cost, _, iterations, time_taken) in enumerate(results)]
+    return bestCost, bestSol, stats
+
+
 if __name__ == "__main__":
     print("Random Search Algorithm")
     print("---------------------------------------------------------")
@@ -44,4 +136,19 @@ if __name__ == "__main__":
     cost, sol = random_search(basin_function_1, searchSpace, problemSize)
     end = time.time()
     print(f"Cost = {cost} \nSolution = {sol} \nTime taken = {end-start}")
-    
\ No newline at end of file
+    
+    print("---------------------------------------------------------")
+    print("Batched random search, 10^8 samples")
+    for basin_function in (basin_function_2, basin_function_1):
+        start = time.time()
+        cost, sol = random_search_batch(basin_function, searchSpace, problemSize, 10**8, seed=0)
+        end = time.time()
+        print(f"Cost = {cost} \nSolution = {sol} \nTime taken = {end-start}")
+    print("---------------------------------------------------------")
+    print("Parallel random search, 10^8 samples over 4 workers")
+    start = time.time()
+    cost, sol, stats = parallel_random_search(basin_function_1, searchSpace, problemSize, 10**8, workers=4, seed=0)
+    end = time.time()
+    print(f"Cost = {cost} \nSolution = {sol} \nTime taken = {end-start}")
+    for worker_stats in stats:
+        print(worker_stats)
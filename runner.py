@@ -0,0 +1,261 @@
+import argparse
+import csv
+import functools
+import glob
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from budget import Budget
+from instrumentation import Stats
+
+JORS_TABLE = "jors_table.csv"
+PJS_TOP_TABLE = "pjs_top_table.csv"
+
+JORS_COLUMNS = ["Instance", "# nodes", "vCap", "Provided CWS Sol", "GAP BSK-CWS (%)", "Best-known Sol.",
+                "GAP OBS-CWS", "GAP OBS-BKS", "My Best Sol.", "# routes (MBS)", " Time (s)"]
+PJS_TOP_COLUMNS = ["Instance", "alpha", "# nodes", "fleetSize", "routeMaxCost", "maxRouteCostFound",
+                   "totalRouteCostFound", " PJS Sol.", "Time (s)"]
+GENERIC_COLUMNS = ["Instance", "Solver", "Parameters", "Sol.", "Time (s)"]
+
+ALPHA_VALUES = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1]
+
+
+@functools.lru_cache(maxsize=None)
+def load_jors_table(path=JORS_TABLE):
+    with open(path) as table:
+        return {row["Instance"]: row for row in csv.DictReader(table)}
+
+
+def gap(cost, reference):
+    return 100 * (cost - reference) / reference
+
+
+def run_cws(instance, vehicle_capacity, num_neighbors=None, stats=None, condensed=False):
+    from cws_vrp import cws_algorithm
+    total_cost, num_routes, num_nodes, time_taken = cws_algorithm(instance, vehicle_capacity, False, num_neighbors, stats, condensed)
+    row = {"Instance": instance, "# nodes": num_nodes, "vCap": f"{vehicle_capacity:g}",
+           "Provided CWS Sol": "", "GAP BSK-CWS (%)": "", "Best-known Sol.": "", "GAP OBS-CWS": "",
+           "GAP OBS-BKS": "", "My Best Sol.": f"{total_cost:.2f}", "# routes (MBS)": num_routes,
+           " Time (s)": f"{time_taken:.3f}"}
+    reference = load_jors_table().get(instance) if os.path.exists(JORS_TABLE) else None
+    if reference is not None:
+        provided = float(reference["Provided CWS Sol"])
+        best_known = float(reference["Best-known Sol."])
+        row["Provided CWS Sol"] = reference["Provided CWS Sol"]
+        row["GAP BSK-CWS (%)"] = reference["GAP BSK-CWS (%)"]
+        row["Best-known Sol."] = reference["Best-known Sol."]
+        row["GAP OBS-CWS"] = f"{gap(total_cost, provided):.2f}"
+        row["GAP OBS-BKS"] = f"{gap(total_cost, best_known):.2f}"
+    return row
+
+
+def run_pjs_top(instance, alpha, stats=None, condensed=False):
+    from pjs_top import pjs_top_algorithm
+    total_cost, num_nodes, fleetSize, routeMaxCost, max_route_cost, total_route_cost, time_taken = pjs_top_algorithm(instance, alpha, False, False, stats=stats, condensed=condensed)
+    return {"Instance": os.path.basename(instance)[:-4], "alpha": alpha, "# nodes": num_nodes,
+            "fleetSize": fleetSize, "routeMaxCost": f"{routeMaxCost:.2f}",
+            "maxRouteCostFound": f"{max_route_cost:.2f}", "totalRouteCostFound": f"{total_route_cost:.2f}",
+            " PJS Sol.": f"{total_cost:.2f}", "Time (s)": f"{time_taken:.3f}"}
+
+
+def run_grasp(instance, **params):
+    from grasp_tsp import grasp_tsp_algorithm
+    _, best_sol, time_taken = grasp_tsp_algorithm(instance, **params)
+    return best_sol.cost, time_taken
+
+
+def run_ils(instance, **params):
+    from ils_tsp import ils_tsp_algorithm
+    _, best_sol, time_taken = ils_tsp_algorithm(instance, **params)
+    return best_sol.cost, time_taken
+
+
+def run_tabu(instance, **params):
+    from tabu_tsp import tabu_tsp_algorithm
+    _, best_sol, time_taken = tabu_tsp_algorithm(instance, **params)
+    return best_sol.cost, time_taken
+
+
+def run_neh(instance, stats=None):
+    from neh_pfsp import neh_pfsp_algorithm
+    sol, _, _, time_taken = neh_pfsp_algorithm(instance, stats)
+    return sol.makespan, time_taken
+
+
+def run_ig(instance, **params):
+    from neh_pfsp import ig_pfsp_algorithm
+    sol, _, time_taken = ig_pfsp_algorithm(instance, **params)
+    return sol.makespan, time_taken
+
+
+def run_random_search(instance, searchSpace=(-5, 5), problemSize=2, maxIterations=100000, budget=None):
+    import rs_bfp
+    start = time.time()
+    cost, _ = rs_bfp.random_search(getattr(rs_bfp, instance), searchSpace, problemSize, maxIterations, budget)
+    return cost, time.time() - start
+
+
+def run_random_search_batch(instance, searchSpace=(-5, 5), problemSize=2, maxIterations=100000, **params):
+    import rs_bfp
+    start = time.time()
+    cost, _ = rs_bfp.random_search_batch(getattr(rs_bfp, instance), searchSpace, problemSize, maxIterations, **params)
+    return cost, time.time() - start
+
+
+TABLE_SOLVERS = {
+    "cws": (run_cws, JORS_COLUMNS),
+    "pjs_top": (run_pjs_top, PJS_TOP_COLUMNS),
+}
+
+SOLVERS = {
+    "grasp": run_grasp,
+    "ils": run_ils,
+    "tabu": run_tabu,
+    "neh": run_neh,
+    "ig": run_ig,
+    "random_search": run_random_search,
+    "random_search_batch": run_random_search_batch,
+}
+
+
+# Solvers whose params may hold "stats": true
+STATS_SOLVERS = {"cws", "pjs_top", "grasp", "ils", "tabu", "neh", "ig"}
+# Solvers whose params may hold a "budget"
+BUDGET_SOLVERS = {"grasp", "ils", "tabu", "random_search", "random_search_batch"}
+
+
+def columns_for(solver):
+    if solver in TABLE_SOLVERS:
+        return TABLE_SOLVERS[solver][1]
+    if solver in SOLVERS:
+        return GENERIC_COLUMNS
+    raise ValueError(f"Unknown solver: {solver}")
+
+
+def check_job(job):
+    # Options a solver cannot take are rejected before any job is run
+    columns_for(job["solver"])
+    params = job.get("params", {})
+    if params.get("stats") and job["solver"] not in STATS_SOLVERS:
+        raise ValueError(f"Solver {job['solver']} does not record stats, supported by: {', '.join(sorted(STATS_SOLVERS))}")
+    if "budget" in params and job["solver"] not in BUDGET_SOLVERS:
+        raise ValueError(f"Solver {job['solver']} does not take a budget, supported by: {', '.join(sorted(BUDGET_SOLVERS))}")
+
+
+def run_job(job):
+    # A job that raises gives a row with its error instead of stopping the
+    # jobs after it
+    try:
+        return _run_job(job)
+    except Exception as error:
+        row = {"Instance": job["instance"], "Error": f"{type(error).__name__}: {error}"}
+        if job["solver"] not in TABLE_SOLVERS:
+            row.update({"Solver": job["solver"], "Parameters": json.dumps(job.get("params", {}))})
+        return row
+
+
+def _run_job(job):
+    solver = job["solver"]
+    params = dict(job.get("params", {}))
+    seed = params.pop("seed", None)
+    if seed is not None:
+        random.seed(seed)
+    # "stats": true adds phase timings and counters to the row
+    stats = None
+    if params.pop("stats", False):
+        stats = Stats()
+        params["stats"] = stats
+    # "budget": {"time_limit": .., "max_evaluations": .., "max_stagnation": ..}
+    # bounds the run and adds why it stopped to the row
+    budget = None
+    if "budget" in params:
+        budget = Budget(**params.pop("budget"))
+        params["budget"] = budget
+    if solver in TABLE_SOLVERS:
+        row = TABLE_SOLVERS[solver][0](job["instance"], **params)
+    else:
+        cost, time_taken = SOLVERS[solver](job["instance"], **params)
+        row = {"Instance": job["instance"], "Solver": solver, "Parameters": json.dumps(job.get("params", {})),
+               "Sol.": f"{cost:.2f}", "Time (s)": f"{time_taken:.3f}"}
+    if stats is not None:
+        row["Stats"] = stats.as_dict()
+    if budget is not None:
+        row["Budget"] = budget.as_dict()
+    return row
+
+
+def run_jobs(jobs, workers=None):
+    # Results come back in job order
+    for job in jobs:
+        check_job(job)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(run_job, jobs)
+
+
+def load_jobs(path):
+    with open(path) as jobs_file:
+        jobs = [json.loads(line) for line in jobs_file if line.strip()]
+    for job in jobs:
+        check_job(job)
+    return jobs
+
+
+def preset_jobs(name):
+    if name == "jors":
+        return [{"solver": "cws", "instance": instance, "params": {"vehicle_capacity": float(row["vCap"])}}
+                for instance, row in load_jors_table().items()]
+    if name == "pjs_top":
+        return [{"solver": "pjs_top", "instance": fileName, "params": {"alpha": alpha}}
+                for fileName in sorted(glob.glob("data/p*.txt")) for alpha in ALPHA_VALUES]
+    raise ValueError(f"Unknown preset: {name}")
+
+
+def write_results(jobs, results, output):
+    if output.name.endswith(".jsonl"):
+        for job, row in zip(jobs, results):
+            output.write(json.dumps({"solver": job["solver"], "params": job.get("params", {}), **row}) + "\n")
+            output.flush()
+        return
+    columns = {tuple(columns_for(job["solver"])) for job in jobs}
+    if len(columns) > 1:
+        raise ValueError("Jobs have different result columns, write them to a .jsonl file")
+    writer = csv.DictWriter(output, fieldnames=list(columns.pop()), lineterminator="\n", extrasaction="ignore")
+    writer.writeheader()
+    for job, row in zip(jobs, results):
+        if "Error" in row:
+            # The table has no error column
+            print(f"{job['solver']} {job['instance']}: {row['Error']}", file=sys.stderr)
+        writer.writerow(row)
+        output.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run solver jobs in a process pool")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--jobs", help="JSONL file with one {solver, instance, params} job per line")
+    source.add_argument("--preset", choices=["jors", "pjs_top"], help="Rebuild one of the committed result tables")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--output", default=None, help="Output .csv or .jsonl file (default: CSV on stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_jobs(args.jobs) if args.jobs else preset_jobs(args.preset)
+    except ValueError as error:
+        parser.error(str(error))
+    columns = {tuple(columns_for(job["solver"])) for job in jobs}
+    if len(columns) > 1 and not (args.output or "").endswith(".jsonl"):
+        parser.error("jobs have different result columns, use --output with a .jsonl file")
+
+    if args.output is None:
+        write_results(jobs, run_jobs(jobs, args.workers), sys.stdout)
+    else:
+        with open(args.output, "w") as output:
+            write_results(jobs, run_jobs(jobs, args.workers), output)
+
+
+if __name__ == "__main__":
+    main()
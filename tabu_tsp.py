@@ -1,5 +1,10 @@
-import math
 import random
+import time
+from loader import load_instance, load_dist_matrix, TSP
+from local_search import TWO_OPT, OR_OPT
+from tour import Tour
+from instrumentation import laps, stream_item
+from budget import Budget, STOPPED, improves
 
 class Node:
     def __init__(self, id, x, y):
@@ -22,131 +27,225 @@ class Node:
     def __hash__(self):
         return hash((self.id, self.x, self.y))
     
-class Route:
-    def __init__(self):
-        self.edges = []
-        self.cost = 0.0
-        self._2_opt_edges = []
-        self.moved_edges = []
+class Route(Tour):
+    def __init__(self, order, dist_matrix=None, stats=None):
+        super().__init__(order, dist_matrix, stats)
         self.num_iterations = 0
 
-    def recompute_cost(self, dist_matrix):
-        self.cost = 0.0
-        for edge in self.edges:
-            self.cost += dist_matrix[edge[0].id][edge[1].id]
-        return self.cost
-
     def __str__(self) -> str:
         return f"{self.edges} -> Cost: {self.cost:.2f} ({self.num_iterations} Iterations)" 
-    
-    def __repr__(self) -> str:
-        return str(self.edges)
-    
-    def has_duplicates(self, nodes):
-        route_nodes = []
-        for edge in self.edges:
-            route_nodes.append(edge[0])
-        
-        route_nodes.sort()
-        original_nodes = nodes.copy()
-        original_nodes.sort()
 
-        return route_nodes != original_nodes
 
+class TwoOptMove:
+    # 2-opt between the edges leaving positions e1 < e2 of a route, scored
+    # by its delta without touching the route
+    def __init__(self, route, e1, e2, dist_matrix):
+        self.e1 = e1
+        self.e2 = e2
+        self.city_1 = route.city(e1)
+        self.city_2 = route.city(e2)
+        self.next_1 = route.city(e1+1)
+        self.next_2 = route.city(e2+1)
+        self.delta = route.two_opt_delta(self.city_1, self.city_2, dist_matrix)
+        self.cost = route.cost + self.delta
+        self._2_opt_edges = [(self.city_1, self.city_2), (self.next_1, self.next_2)]
+
+    def is_tabu(self, route, tabu_set):
+        # The moved path is city_1 -> city_2 -> ... -> next_1 -> next_2, the
+        # inner edges being those of positions e1+1..e2 walked backwards, so
+        # (a, b) is one of them when b -> a is an edge inside that range
+        for a, b in tabu_set:
+            if (a, b) in self._2_opt_edges:
+                return True
+            position = route.pos[b]
+            if self.e1 < position < self.e2 and route.city(position+1) == a:
+                return True
+        return False
 
-def dist(node_1: Node, node_2: Node):
-    return math.sqrt((node_1.x - node_2.x)**2 + (node_1.y - node_2.y)**2)
+    def apply(self, route):
+        new_route = route.copy()
+        new_route.two_opt_move(self.city_1, self.city_2, self.delta)
+        return new_route
+
+
+class OrOptMove:
+    # Move the path first -> ... -> last between u -> v
+    def __init__(self, route, first, last, u, v, reverse, dist_matrix):
+        self.first = first
+        self.last = last
+        self.u = u
+        self.v = v
+        self.reverse = reverse
+        self.delta = route.or_opt_delta(first, last, u, v, reverse, dist_matrix)
+        self.cost = route.cost + self.delta
+        prev_city = route.pred(first)
+        next_city = route.succ(last)
+        if reverse:
+            self.moved_edges = [(prev_city, next_city), (u, last), (first, v)]
+        else:
+            self.moved_edges = [(prev_city, next_city), (u, first), (last, v)]
+        self._2_opt_edges = self.moved_edges[1:]
 
-def stochastic_2_opt(route, dist_matrix):
-    new_route = Route()
-    new_route.edges = route.edges.copy()
-    
-    e1 = random.randint(0, len(new_route.edges)-2)
-    e2 = random.randint(e1+1, len(new_route.edges)-1)
+    def is_tabu(self, route, tabu_set):
+        return not tabu_set.isdisjoint(self.moved_edges)
 
-    edge_1 = new_route.edges[e1]
-    edge_2 = new_route.edges[e2]
+    def apply(self, route):
+        new_route = route.copy()
+        new_route.or_opt_move(self.first, self.last, self.u, self.v, self.reverse, self.delta)
+        return new_route
 
-    new_route.edges[e1] = (edge_1[0], edge_2[0])
-    new_route.edges[e2] = (edge_1[1], edge_2[1])
-    
-    edges_between_them = new_route.edges[e1+1:e2]
-    edges_between_them.reverse()
-    for k in range(len(edges_between_them)):
-        edges_between_them[k] = (edges_between_them[k][1], edges_between_them[k][0])
-    
-    new_route.edges[e1+1:e2] = edges_between_them
 
-    new_route.recompute_cost(dist_matrix)
+def stochastic_2_opt(route, dist_matrix):
+    e1 = random.randint(0, route.n-2)
+    e2 = random.randint(e1+1, route.n-1)
+    return TwoOptMove(route, e1, e2, dist_matrix)
 
-    new_route._2_opt_edges.append(new_route.edges[e1])
-    new_route._2_opt_edges.append(new_route.edges[e2])
+def stochastic_or_opt(route, dist_matrix, max_segment=3):
+    length = random.randint(1, min(max_segment, route.n-3))
+    first = route.city(random.randint(0, route.n-1))
+    last = first
+    for _ in range(length-1):
+        last = route.succ(last)
 
-    new_route.moved_edges = [new_route.edges[e1]]+edges_between_them+[new_route.edges[e2]]
+    # Insert between any u -> v outside the segment
+    u = route.city(route.pos[last] + 1 + random.randint(0, route.n-length-2))
+    v = route.succ(u)
+    reverse = random.random() < 0.5
 
-    return new_route
+    return OrOptMove(route, first, last, u, v, reverse, dist_matrix)
 
-def generate_new_solution(base_route, best_route, tabu_set, dist_matrix):
+def generate_new_solution(base_route, best_route, tabu_set, dist_matrix, move_type=TWO_OPT, stats=None, budget=None):
+    # Returns a move on base_route, base_route itself is left unchanged
 
-    new_route = None
+    move = None
+    evaluated = 0
 
-    while new_route is None or is_tabu(new_route, tabu_set):
+    while move is None or is_tabu(move, base_route, tabu_set):
 
-        new_route = stochastic_2_opt(base_route, dist_matrix)
+        if move_type == OR_OPT:
+            move = stochastic_or_opt(base_route, dist_matrix)
+        else:
+            move = stochastic_2_opt(base_route, dist_matrix)
+        evaluated += 1
 
-        if new_route.cost < best_route.cost:
+        if move.cost < best_route.cost:
             break
+
+    if stats is not None:
+        # Every move drawn after the first replaced a tabu one
+        stats.add("moves evaluated", evaluated)
+        stats.add("tabu rejections", evaluated - 1)
+    if budget is not None:
+        budget.add_evaluations(evaluated)
     
-    return new_route
+    return move
 
 
-def is_tabu(route, tabu_set):
-    if len(tabu_set.intersection(route.moved_edges)) == 0:
-        return False
-    return True
+def is_tabu(move, route, tabu_set):
+    return move.is_tabu(route, tabu_set)
 
 
-def construct_initial_solution(nodes, dist_matrix):
+def construct_initial_solution(nodes, dist_matrix, stats=None):
     random.shuffle(nodes)
-    route = Route()
-    for i in range(len(nodes)-1):
-        route.edges.append((nodes[i], nodes[i+1]))
-        route.cost += dist_matrix[nodes[i].id][nodes[i+1].id]
-
-    route.edges.append((nodes[-1], nodes[0]))
-    route.cost += dist_matrix[nodes[-1].id][nodes[0].id]
-    return route
+    return Route([node.id for node in nodes], dist_matrix, stats)
 
 def perturbation(route, dist_matrix, random_segments=4):
 
-    new_route = Route()
-    new_route.edges = route.edges.copy()
+    new_route = route.copy()
 
-    start_index = random.randint(0, len(new_route.edges)-(1+random_segments))
+    start_index = random.randint(0, new_route.n-(1+random_segments))
 
-    nodes = set()
-    for i in range(random_segments):
-        nodes.add(new_route.edges[start_index+i][0])
-        nodes.add(new_route.edges[start_index+i][1])
-    
-    new_nodes = list(nodes)
+    new_nodes = new_route.order[start_index:start_index+random_segments+1].tolist()
 
     random.shuffle(new_nodes)
 
-    for i in range(len(new_nodes)-1):
-        new_route.edges[start_index+i] = (new_nodes[i], new_nodes[i+1])
-
-    if start_index > 0:
-        new_route.edges[start_index-1] = (new_route.edges[start_index-1][0], new_nodes[0])
-
-    if start_index+random_segments < len(new_route.edges):
-        new_route.edges[start_index+random_segments] = (new_nodes[-1], new_route.edges[start_index+random_segments][1])
-        
-    new_route.cost = new_route.recompute_cost(dist_matrix)
+    new_route.replace_segment(start_index, new_nodes, dist_matrix)
 
     return new_route
     
 
+def tabu_tsp_stream(filename, max_iterations=500, max_edges_tabu_list=10, max_new_sols=40, k=5, move_type=TWO_OPT, stats=None, budget=None, condensed=False):
+    # Anytime tabu search, see stream_item. The first item is the initial random tour.
+    start = time.time()
+    budget = (Budget() if budget is None else budget).start()
+    lap = laps(stats)
+
+    # Load file
+    coords = load_instance(filename, TSP)["coords"]
+    nodes = [Node(i, x, y) for i, (x, y) in enumerate(coords.tolist())]
+    lap("load")
+
+    # Distance Matrix, computed once per file and then read from the cache
+    dist_matrix = load_dist_matrix(filename, TSP, condensed=condensed)
+    lap("distance matrix")
+
+    try:
+        initial_sol = construct_initial_solution(nodes, dist_matrix, stats)
+        budget.add_evaluations()
+        lap("construction")
+        yield from stream_item(start, 0, initial_sol, stats)
+
+        base_sol = initial_sol
+        best_sol = initial_sol
+
+        credit = 0
+        tabu_list = []
+        tabu_set = set()
+
+        for i in budget.iterations(max_iterations):
+            # Candidates are scored as moves, only the chosen one is applied
+            best_move = None
+            for j in range(max_new_sols):
+                move = generate_new_solution(base_sol, best_sol, tabu_set, dist_matrix, move_type, stats, budget)
+                if best_move is None or move.cost < best_move.cost:
+                    best_move = move
+            lap("candidates")
+
+            delta = best_move.cost - base_sol.cost
+            improved = improves(best_move.cost, best_sol.cost)
+            budget.end_iteration(improved)
+            if delta <= 0:
+                credit = -1 * delta
+                base_sol = best_move.apply(base_sol)
+
+                if improved:
+                    best_sol = base_sol
+                    best_sol.num_iterations = i
+                    yield from stream_item(start, i+1, best_sol, stats)
+
+                    for edge in best_move._2_opt_edges:
+                        tabu_list.append(edge)
+                        tabu_set.add(edge)
+
+                        if len(tabu_list) > max_edges_tabu_list:
+                            try:
+                                tabu_set.remove(tabu_list[0])
+                            except:
+                                pass
+                            del tabu_list[0]
+            else:
+                if delta <= k * credit:
+                    credit = 0
+                    base_sol = best_move.apply(base_sol)
+            lap("apply move")
+    finally:
+        budget.finish(STOPPED)
+
+
+def tabu_tsp_algorithm(filename, max_iterations=500, max_edges_tabu_list=10, max_new_sols=40, k=5, move_type=TWO_OPT, stats=None, budget=None, condensed=False):
+    start = time.time()
+
+    # The first tour of the stream is the initial random one
+    initial_sol = None
+    for _, _, _, best_sol in tabu_tsp_stream(filename, max_iterations, max_edges_tabu_list, max_new_sols, k, move_type, stats, budget, condensed):
+        if initial_sol is None:
+            initial_sol = best_sol
+
+    end = time.time()
+
+    return initial_sol, best_sol, end-start
+
+
 if __name__ == "__main__":
 
     filename = "berlin52.txt"
@@ -155,66 +254,9 @@ if __name__ == "__main__":
     max_edges_tabu_list = 10
     max_new_sols = 40
     k = 5
+    move_type = TWO_OPT
 
-    # Load file
-    with open(filename) as instance:
-        nodes = []
-        for line in instance:
-            data = [x for x in line.split()]
-            node = Node(int(data[0])-1, float(data[1]), float(data[2]))
-            nodes.append(node)
-
-    # Compute Distance Matrix
-    dist_matrix = [[0]*len(nodes) for _ in range(len(nodes))]
-    for i, node_1 in enumerate(nodes):
-        for j, node_2 in enumerate(nodes):
-            if i<j:
-                dist_matrix[i][j] = dist(node_1, node_2)
-                dist_matrix[j][i] = dist_matrix[i][j]
-
-    initial_sol = construct_initial_solution(nodes, dist_matrix)
-
-    base_sol = initial_sol
-    best_sol = initial_sol
-
-    credit = 0
-    tabu_list = []
-    tabu_set = set()
-
-    for i in range(max_iterations):
-        best_new_sol = Route()
-        best_new_sol.cost = float("inf")
-        new_sols = []
-        for j in range(max_new_sols):
-            new_sol = generate_new_solution(base_sol, best_sol, tabu_set, dist_matrix)
-            new_sols.append(new_sol)
-            if new_sol.cost < best_new_sol.cost:
-                best_new_sol = new_sol
-
-        delta = best_new_sol.cost - base_sol.cost
-        if delta <= 0:
-            credit = -1 * delta
-            base_sol = best_new_sol
-
-            if best_new_sol.cost < best_sol.cost:
-                best_sol = best_new_sol
-                best_sol.num_iterations = i
-
-                for edge in best_new_sol._2_opt_edges:
-                    tabu_list.append(edge)
-                    tabu_set.add(edge)
-
-                    if len(tabu_list) > max_edges_tabu_list:
-                        try:
-                            tabu_set.remove(tabu_list[0])
-                        except:
-                            pass
-                        del tabu_list[0]
-        else:
-            if delta <= k * credit:
-                credit = 0
-                base_sol = best_new_sol
-
+    initial_sol, best_sol, _ = tabu_tsp_algorithm(filename, max_iterations, max_edges_tabu_list, max_new_sols, k, move_type)
 
     print("Instance Name: "+filename.split(".")[0])
     print("-------------------------------------")
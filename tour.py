@@ -0,0 +1,145 @@
+import copy
+
+import numpy as np
+
+
+class Tour:
+    # Full cost recomputations of this tour and of its copies are counted
+    # in stats when one is given
+    def __init__(self, order, dist_matrix=None, stats=None):
+        self.stats = stats
+        self.order = np.array(order, dtype=np.int32)
+        self.n = len(self.order)
+        self.pos = np.empty(self.n, dtype=np.int32)
+        self.pos[self.order] = np.arange(self.n, dtype=np.int32)
+        self.cost = 0.0
+        if dist_matrix is not None:
+            self.recompute_cost(dist_matrix)
+
+    def recompute_cost(self, dist_matrix):
+        if self.stats is not None:
+            self.stats.add("recompute_cost calls")
+        if self.n < 2:
+            self.cost = 0.0
+        else:
+            self.cost = float(np.sum(dist_matrix[self.order, np.roll(self.order, -1)]))
+        return self.cost
+
+    def city(self, position):
+        return int(self.order[position % self.n])
+
+    def succ(self, city):
+        position = self.pos[city] + 1
+        if position == self.n:
+            position = 0
+        return int(self.order[position])
+
+    def pred(self, city):
+        return int(self.order[self.pos[city] - 1])
+
+    def reverse(self, first, last):
+        # Reverse the path first -> ... -> last in place. The shorter of
+        # the path and its complement is flipped, both give the same tour.
+        i, j = int(self.pos[first]), int(self.pos[last])
+        length = j - i + 1 if i <= j else self.n - i + j + 1
+        if 2 * length > self.n:
+            i, j = j + 1, i - 1
+            if i == self.n:
+                i = 0
+            if j < 0:
+                j = self.n - 1
+            length = self.n - length
+        if length < 2:
+            return
+        if i + length <= self.n:
+            segment = self.order[i:i+length]
+            segment[:] = segment[::-1].copy()
+            self.pos[segment] = np.arange(i, i + length, dtype=np.int32)
+        else:
+            positions = (i + np.arange(length)) % self.n
+            self.order[positions] = self.order[positions[::-1]]
+            self.pos[self.order[positions]] = positions
+
+    def two_opt_delta(self, a, c, dist_matrix):
+        # Replace edges (a, succ a) and (c, succ c) by (a, c) and (succ a, succ c)
+        b = self.succ(a)
+        d = self.succ(c)
+        return dist_matrix[a, c] + dist_matrix[b, d] - dist_matrix[a, b] - dist_matrix[c, d]
+
+    def two_opt_move(self, a, c, delta):
+        self.reverse(self.succ(a), c)
+        self.cost += delta
+
+    def exchange(self, a, b, c, d, delta=0.0):
+        # Replace edges (a, b) and (c, d), both running the same way round
+        # the tour, by (a, c) and (b, d)
+        if self.succ(a) == b:
+            self.two_opt_move(a, c, delta)
+        else:
+            self.two_opt_move(b, d, delta)
+
+    def or_opt_delta(self, first, last, u, v, reverse, dist_matrix):
+        # Move the path first -> ... -> last between the adjacent cities u -> v
+        p = self.pred(first)
+        n = self.succ(last)
+        removed = dist_matrix[p, first] + dist_matrix[last, n] + dist_matrix[u, v]
+        if reverse:
+            added = dist_matrix[u, last] + dist_matrix[first, v]
+        else:
+            added = dist_matrix[u, first] + dist_matrix[last, v]
+        return added + dist_matrix[p, n] - removed
+
+    def or_opt_move(self, first, last, u, v, reverse, delta):
+        # Done as two or three 2-opt exchanges so it works whichever side
+        # each reversal flips
+        p = self.pred(first)
+        n = self.succ(last)
+        self.exchange(p, first, u, v)
+        self.exchange(p, u, n, last)
+        if not reverse:
+            self.exchange(u, last, first, v)
+        self.cost += delta
+
+    def replace_segment(self, start, cities, dist_matrix):
+        # Write cities into positions start, start+1, ... and update the cost
+        # from the edges in and around the segment only
+        end = start + len(cities)
+        if len(cities) + 1 >= self.n:
+            self.order[start:end] = cities
+            self.pos[self.order[start:end]] = np.arange(start, end, dtype=np.int32)
+            return self.recompute_cost(dist_matrix)
+        old_cost = self.path_cost(start - 1, end, dist_matrix)
+        self.order[start:end] = cities
+        self.pos[self.order[start:end]] = np.arange(start, end, dtype=np.int32)
+        self.cost += self.path_cost(start - 1, end, dist_matrix) - old_cost
+        return self.cost
+
+    def path_cost(self, first, last, dist_matrix):
+        # Cost of the edges between positions first and last (cyclic)
+        cost = 0.0
+        for position in range(first, last):
+            cost += dist_matrix[self.city(position), self.city(position + 1)]
+        return cost
+
+    @property
+    def edges(self):
+        order = self.order.tolist()
+        return list(zip(order, order[1:] + order[:1]))
+
+    def copy(self):
+        new_tour = copy.copy(self)
+        new_tour.order = self.order.copy()
+        new_tour.pos = self.pos.copy()
+        return new_tour
+
+    def has_duplicates(self, nodes):
+        return sorted(self.order.tolist()) != sorted(node.id for node in nodes)
+
+    def __len__(self):
+        return self.n
+
+    def __str__(self) -> str:
+        return f"{self.edges} -> Cost: {self.cost:.2f}"
+
+    def __repr__(self) -> str:
+        return str(self.edges)